@@ -1,12 +1,24 @@
 """This module contains helpers for building up search queries."""
 
+import collections
+import json
+
+from query_builder import exceptions
 import query_builder.app.elastic.filters as es_filter
+from query_builder.app.elastic.optimizer import optimize_filters, order_by_cost
+from query_builder.app.elastic.query_cache import copy_query
+from query_builder.app.elastic.dialects import get_dialect
+from query_builder.config import settings
 
 
+def dumps(query):
+    """Serialise query to compact JSON."""
+    return json.dumps(query, separators=(",", ":"))
 
-def _get_generic_filters(params):
-    """Compile all the filters in the query."""
-    filters = [
+
+def _status_filters(params):
+    """Only live companies are searched."""
+    return [
         {
             "term": {
                 "status": 1
@@ -14,38 +26,105 @@ def _get_generic_filters(params):
         }
     ]
 
-    filters += es_filter.basic_filters(params)
-    filters += es_filter.trading_activity_filters(params)
-    filters += es_filter.cids_filters(params)
 
-    filter_dsl = {}
-    if filters:
-        filter_dsl = {'and': filters}
+# Groups of the filters AND-ed into the query, in query order: the parameter
+# keys each group is built from and its builder. The optimizer never combines
+# filters from different groups, so each group is optimised on its own and
+# only needs rebuilding when one of its keys changes.
+FILTER_GROUPS = (
+    ((), _status_filters),
+    (("revenue", "cash", "sectors", "ecommerce", "exclude_tps"),
+     es_filter.basic_filters),
+    (("trading_activity",), es_filter.trading_activity_filters),
+    (("cids", "cid_list"), es_filter.cids_filters),
+)
+
+# Parameter keys which only change the AND-ed filters
+FILTER_ONLY_KEYS = frozenset(
+    key for keys, _ in FILTER_GROUPS for key in keys) - {"trading_activity"}
+
+
+def _build_filter_group(group, params):
+    """Build (and optimise) the filters of one of FILTER_GROUPS."""
+    keys, builder = FILTER_GROUPS[group]
+    filters = builder(dict((key, params[key]) for key in keys
+                           if key in params))
+    if settings.app_settings["optimize_filters"]:
+        filters = optimize_filters(filters)
+    return tuple(filters)
 
-    return filter_dsl
+
+def _join_filter_groups(filter_groups):
+    """AND the filters of all groups together, cheap first if optimising."""
+    filters = [filt for group in filter_groups for filt in group]
+    if settings.app_settings["optimize_filters"]:
+        filters = order_by_cost(filters)
+    return filters
+
+
+def _get_generic_filters(params):
+    """Compile all the filters in the query."""
+    filter_groups = [_build_filter_group(group, params)
+                     for group in range(len(FILTER_GROUPS))]
+    return {'and': _join_filter_groups(filter_groups)}
 
 
 def vanilla_query():
     """Return a vanilla query"""
 
-    query = {
-        "query": {
-            "filtered": {
-                "filter": {
-                    "and": []
-                }
-            }
-        }
-    }
+    query = get_dialect().query([])
     return query
 
+def _add_post_filter(es_query, params):
+    """Function adds filters applied after the query, if there are any."""
+
+    post_filters = es_filter.trading_activity_post_filters(params)
+    if len(post_filters) == 1:
+        es_query["post_filter"] = post_filters[0]
+    elif post_filters:
+        es_query["post_filter"] = get_dialect().and_filter(post_filters)
+
+    return es_query
+
+
+def _add_aggregations(es_query, params):
+    """Function adds aggregations to aggregate=true queries.
+
+    All configured aggregations are added, unless particular ones are
+    requested by name. They are computed over the main query only: with
+    trading_activity_exact_post_filter enabled the counts cover the rounded
+    trading_activity dates, not the exact ones applied by the post_filter.
+    """
+
+    if not params.get("aggregate"):
+        return es_query
+
+    names = params.get("aggregations") or sorted(
+        settings.COMPANIES_AGGREGATIONS)
+    aggs = {}
+    for name in names:
+        try:
+            aggs[name] = copy_query(settings.COMPANIES_AGGREGATIONS[name])
+        except KeyError:
+            raise exceptions.ParameterValueError(key="aggregation",
+                                                 value=name)
+    es_query["aggs"] = aggs
+
+    return es_query
+
+
 def _add_fields_pagination(es_query, params):
     """Function adds fields and pagination params to query.
 
     Fields are the requested fields to be returned.
     Pagination parameters is the number of results and offset to return.
+    Aggregation and count only queries return no documents.
     """
 
+    if params.get("aggregate") or params.get("count_only"):
+        es_query["size"] = 0
+        return es_query
+
     if "size" in params:
         es_query["size"] = params["size"]
 
@@ -55,22 +134,110 @@ def _add_fields_pagination(es_query, params):
     if "fields" in params:
         es_query["fields"] = params["fields"]
 
+    if "source_includes" in params or "source_excludes" in params:
+        es_query["_source"] = get_dialect().source_filter(
+            params.get("source_includes"), params.get("source_excludes"))
+
+    if "sort" in params:
+        es_query["sort"] = params["sort"]
+
+    if "search_after" in params:
+        es_query["search_after"] = params["search_after"]
+
     return es_query
 
 
+def _get_extras(params):
+    """Top level keys following the filters: post filter, aggs and paging."""
+    return _add_fields_pagination(
+        _add_aggregations(_add_post_filter({}, params), params), params)
+
+
 def query_builder(params):
     """Build the companies search query.
 
     This method also returns instructions on how to colour the results
     """
-    query_dsl = vanilla_query()
-
     filter_dsl = _get_generic_filters(params)
 
-    # Add the filters to the query:
-    query_dsl["query"]["filtered"]["filter"]["and"] += filter_dsl["and"]
+    # Fill the filters straight into the vanilla query template
+    query_dsl = get_dialect().query(filter_dsl["and"])
+
+    query_dsl = _add_post_filter(query_dsl, params)
+    query_dsl = _add_aggregations(query_dsl, params)
 
     # Pagination
     query_dsl = _add_fields_pagination(query_dsl, params)
 
-    return query_dsl
\ No newline at end of file
+    return query_dsl
+
+
+def query_builder_json(params):
+    """Build the companies search query as compact UTF-8 encoded JSON.
+
+    Equivalent to serialising query_builder(params): the query tree is built
+    and serialised once, and Piston logs and returns the same bytes.
+    """
+    return dumps(query_builder(params))
+
+
+class QueryHandle(collections.namedtuple(
+        "QueryHandle", ["params", "filter_groups", "extras", "query"])):
+    """A built query, with the parts patch_query reuses."""
+    __slots__ = ()
+
+
+def _make_handle(params, filter_groups, extras):
+    query = get_dialect().query(_join_filter_groups(filter_groups))
+    query.update(extras)
+    return QueryHandle(params, filter_groups, extras, query)
+
+
+def build_query_handle(params):
+    """Build the companies search query, returning a patchable QueryHandle.
+
+    handle.query is equal to query_builder(params).
+    """
+    filter_groups = tuple(_build_filter_group(group, params)
+                          for group in range(len(FILTER_GROUPS)))
+    return _make_handle(dict(params), filter_groups, _get_extras(params))
+
+
+def patch_query(handle, delta):
+    """Return the handle of handle's query with its params updated by delta.
+
+    Arguments:
+        handle: QueryHandle from build_query_handle or patch_query.
+        delta: dict of parsed params to set, a None value removing the key.
+    Returns:
+        QueryHandle of the new query.
+
+    Only the filter groups built from changed keys are rebuilt. Unchanged
+    filters and top level keys are shared with the old query, not copied, so
+    queries must not be modified once built.
+    """
+    params = dict(handle.params)
+    changed = set()
+    for key, value in delta.iteritems():
+        if value is None:
+            if key in params:
+                del params[key]
+                changed.add(key)
+        elif key not in params or params[key] != value:
+            params[key] = value
+            changed.add(key)
+
+    if not changed:
+        return handle
+
+    filter_groups = tuple(
+        _build_filter_group(group, params) if changed.intersection(keys)
+        else filters
+        for group, ((keys, _), filters)
+        in enumerate(zip(FILTER_GROUPS, handle.filter_groups)))
+
+    extras = handle.extras
+    if not changed <= FILTER_ONLY_KEYS:
+        extras = _get_extras(params)
+
+    return _make_handle(params, filter_groups, extras)
@@ -0,0 +1,177 @@
+"""Output dialects of the Elasticsearch query DSL.
+
+legacy renders the 1.x filter DSL (filtered / and / or / missing). bool
+renders the 5.x+ (and OpenSearch) DSL, where every filter sits in a
+bool.filter context and so is cacheable by the cluster. The dialect used is
+selected by settings.ES_DIALECT.
+"""
+
+from query_builder.config import settings
+
+
+class LegacyDialect(object):
+    """Elasticsearch 1.x filter DSL."""
+
+    name = "legacy"
+
+    def query(self, filters):
+        """Top level query matching documents passing all filters."""
+        return {
+            "query": {
+                "filtered": {
+                    "filter": {
+                        "and": filters
+                    }
+                }
+            }
+        }
+
+    def child_doc_filter(self, doc_type, date_name, gte, lte, cache_key=None):
+        """Parent documents with a child whose date_name is in range.
+
+        With a cache_key the child side range filter is cached; has_child
+        itself is not cacheable.
+        """
+        range_filter = {
+            "range": {
+                date_name: {
+                    "gte": gte,
+                    "lte": lte
+                }
+            }
+        }
+        if cache_key is not None:
+            range_filter = self.cached_filter(range_filter, cache_key)
+        return {
+            "has_child": {
+                "type": doc_type,
+                "filter": {
+                    "and": [range_filter]
+                }
+            }
+        }
+
+    def nested_filter(self, path, filters):
+        """Documents with a nested object at path passing all filters."""
+        return {
+            "nested": {
+                "path": path,
+                "filter": {
+                    "bool": {
+                        "must": filters
+                    }
+                }
+            }
+        }
+
+    def or_filter(self, filters):
+        """Documents passing any of filters."""
+        return {"or": filters}
+
+    def missing_filter(self, field):
+        """Documents without a value for field."""
+        return {"missing": {"field": field}}
+
+    def and_filter(self, filters):
+        """Documents passing all of filters."""
+        return {"and": filters}
+
+    def source_filter(self, includes, excludes):
+        """_source filtering of the returned documents."""
+        source = {}
+        if includes:
+            source["include"] = includes
+        if excludes:
+            source["exclude"] = excludes
+        return source
+
+    def cached_filter(self, filt, cache_key):
+        """Ask the cluster to cache filt's results under cache_key."""
+        clause = next(iter(filt.values()))
+        clause["_cache"] = True
+        clause["_cache_key"] = cache_key
+        return filt
+
+
+class BoolDialect(LegacyDialect):
+    """Elasticsearch 5.x+ / OpenSearch bool query DSL."""
+
+    name = "bool"
+
+    def query(self, filters):
+        return {
+            "query": {
+                "bool": {
+                    "filter": filters
+                }
+            }
+        }
+
+    def child_doc_filter(self, doc_type, date_name, gte, lte, cache_key=None):
+        return {
+            "has_child": {
+                "type": doc_type,
+                "query": {
+                    "bool": {
+                        "filter": [
+                            {
+                                "range": {
+                                    date_name: {
+                                        "gte": gte,
+                                        "lte": lte
+                                    }
+                                }
+                            }
+                        ]
+                    }
+                }
+            }
+        }
+
+    def nested_filter(self, path, filters):
+        return {
+            "nested": {
+                "path": path,
+                "query": {
+                    "bool": {
+                        "filter": filters
+                    }
+                }
+            }
+        }
+
+    def or_filter(self, filters):
+        return {"bool": {"should": filters, "minimum_should_match": 1}}
+
+    def missing_filter(self, field):
+        return {"bool": {"must_not": [{"exists": {"field": field}}]}}
+
+    def and_filter(self, filters):
+        return {"bool": {"filter": filters}}
+
+    def source_filter(self, includes, excludes):
+        source = {}
+        if includes:
+            source["includes"] = includes
+        if excludes:
+            source["excludes"] = excludes
+        return source
+
+    def cached_filter(self, filt, cache_key):
+        # Filter context clauses are cached automatically
+        return filt
+
+
+DIALECTS = {
+    LegacyDialect.name: LegacyDialect(),
+    BoolDialect.name: BoolDialect(),
+}
+
+
+def get_dialect(name=None):
+    """Return the dialect called name, defaulting to settings.ES_DIALECT."""
+    name = name or settings.ES_DIALECT
+    try:
+        return DIALECTS[name]
+    except KeyError:
+        raise ValueError("Unknown ES dialect: {}".format(name))
@@ -0,0 +1,246 @@
+"""Execution of built queries against Elasticsearch.
+
+Searches submitted concurrently are collected for a short window and sent
+as a single _msearch request over a pool of persistent connections.
+"""
+
+import contextlib
+import httplib
+import json
+import socket
+import threading
+import time
+import urlparse
+import Queue
+
+from query_builder.exceptions import ESSearchError
+
+# Errors after which a request is retried on a fresh connection
+RETRYABLE_ERRORS = (socket.error, httplib.HTTPException)
+
+
+class ConnectionPool(object):
+    """Fixed size pool of keep-alive HTTP connections to one host."""
+
+    def __init__(self, host, port, size=10, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._connections = Queue.LifoQueue()
+        for _ in range(size):
+            self._connections.put(None)
+
+    def _connect(self):
+        return httplib.HTTPConnection(self.host, self.port,
+                                      timeout=self.timeout)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a connection, which is discarded if the request fails."""
+        conn = self._connections.get() or self._connect()
+        try:
+            yield conn
+        except Exception:
+            conn.close()
+            conn = None
+            raise
+        finally:
+            self._connections.put(conn)
+
+    def request(self, method, path, body, headers=None):
+        """Make a request, returning (status, response body)."""
+        with self.connection() as conn:
+            conn.request(method, path, body, headers or {})
+            response = conn.getresponse()
+            return response.status, response.read()
+
+    def close(self):
+        while True:
+            try:
+                conn = self._connections.get_nowait()
+            except Queue.Empty:
+                return
+            if conn is not None:
+                conn.close()
+
+
+class _PendingSearch(object):
+    __slots__ = ("query", "event", "response", "error")
+
+    def __init__(self, query):
+        self.query = query
+        self.event = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class ESExecutor(object):
+    """Runs searches against an Elasticsearch index.
+
+    Args:
+        url: base URL of the cluster e.g. http://localhost:9200
+        index: index searched
+        doc_type: mapping type searched, None to search every type
+        pool_size: number of persistent connections, and of _msearch
+            requests in flight at once
+        timeout: socket timeout in seconds
+        retries: times a failed request is retried
+        batch_window: seconds to wait for more searches before sending a
+            batch, 0 sends each search as soon as a connection is free
+        max_batch_size: most searches sent in one _msearch request
+    """
+
+    def __init__(self, url, index, doc_type=None, pool_size=10, timeout=5.0,
+                 retries=2, batch_window=0.002, max_batch_size=100):
+        parsed = urlparse.urlparse(url)
+        self.pool = ConnectionPool(parsed.hostname, parsed.port or 9200,
+                                   size=pool_size, timeout=timeout)
+        self.path_prefix = parsed.path.rstrip("/")
+        self.index = index
+        self.doc_type = doc_type
+        self.retries = retries
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+
+        self.batches_sent = 0
+        self.searches_sent = 0
+
+        self._pending = Queue.Queue()
+        self._batches = Queue.Queue(maxsize=pool_size)
+        self._closed = False
+        # Held while enqueueing searches and marking the executor closed, so
+        # no search is queued behind the collector's stop sentinel
+        self._close_lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._collect,
+                                          name="es-executor-collector")]
+        self._threads += [threading.Thread(target=self._send_batches,
+                                           name="es-executor-sender")
+                          for _ in range(pool_size)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def search(self, query):
+        """Run a single search and return the ES response dict.
+
+        query is a dict or pre-serialised JSON. The search is sent as part of
+        a batched _msearch request with any concurrent searches.
+        """
+        pending = _PendingSearch(query)
+        with self._close_lock:
+            if self._closed:
+                raise ESSearchError("Executor is closed")
+            self._pending.put(pending)
+        pending.event.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.response
+
+    def msearch(self, queries):
+        """Run queries in one _msearch request, returning their responses.
+
+        Errors of individual searches are returned as ESSearchError
+        instances in place of their response.
+        """
+        header = {"index": self.index}
+        if self.doc_type:
+            header["type"] = self.doc_type
+        header = json.dumps(header)
+
+        lines = []
+        for query in queries:
+            lines.append(header)
+            lines.append(query if isinstance(query, basestring)
+                         else json.dumps(query, separators=(",", ":")))
+        body = "\n".join(lines) + "\n"
+
+        response = self._request("POST", "{}/_msearch".format(
+            self.path_prefix), body)
+        responses = response.get("responses", [])
+        if len(responses) != len(queries):
+            raise ESSearchError("Expected {} responses, got {}".format(
+                len(queries), len(responses)))
+
+        self.batches_sent += 1
+        self.searches_sent += len(queries)
+        return [ESSearchError(r["error"], r.get("status"))
+                if "error" in r else r for r in responses]
+
+    def close(self):
+        """Stop the batching threads and close every connection.
+
+        Searches already submitted are sent before the threads stop.
+        """
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._pending.put(None)
+        for thread in self._threads:
+            thread.join()
+        self.pool.close()
+
+    def _request(self, method, path, body):
+        headers = {"Content-Type": "application/x-ndjson"}
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            try:
+                status, data = self.pool.request(method, path, body, headers)
+            except RETRYABLE_ERRORS as e:
+                if last_attempt:
+                    raise ESSearchError(str(e))
+            else:
+                if status < 500 or last_attempt:
+                    break
+            time.sleep(0.01 * 2 ** attempt)
+
+        try:
+            data = json.loads(data)
+        except ValueError:
+            raise ESSearchError("Malformed response: {!r}".format(data[:200]),
+                                status)
+        if status >= 400:
+            raise ESSearchError(data.get("error", data), status)
+        return data
+
+    def _collect(self):
+        """Group pending searches into batches."""
+        while True:
+            first = self._pending.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.time() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.time()
+                try:
+                    if timeout > 0:
+                        pending = self._pending.get(timeout=timeout)
+                    else:
+                        pending = self._pending.get_nowait()
+                except Queue.Empty:
+                    break
+                if pending is None:
+                    self._pending.put(None)
+                    break
+                batch.append(pending)
+            self._batches.put(batch)
+
+        for _ in self._threads[1:]:
+            self._batches.put(None)
+
+    def _send_batches(self):
+        while True:
+            batch = self._batches.get()
+            if batch is None:
+                return
+            try:
+                responses = self.msearch([pending.query for pending in batch])
+            except Exception as e:
+                responses = [e] * len(batch)
+            for pending, response in zip(batch, responses):
+                if isinstance(response, Exception):
+                    pending.error = response
+                else:
+                    pending.response = response
+                pending.event.set()
@@ -2,9 +2,12 @@
 """Contains functions for building filters in ES queries."""
 
 from query_builder.app.elastic import (query_helpers, query_build_exception)
+from query_builder.app.instrumentation import instrumented
+from query_builder.app.taxonomy import get_sector_taxonomy
 from query_builder.config import settings
 
 
+@instrumented("filters.basic_filters")
 def basic_filters(params):
     """Build up basic filters.
 
@@ -20,46 +23,153 @@ def basic_filters(params):
         filters.append(f)
 
     if "sectors" in params:
-        filters.append(query_helpers.exact_matches(settings.SECTOR_ES_FIELD,
-                                                   params["sectors"]))
+        filters.append(_sectors_filter(params["sectors"]))
 
     if 'ecommerce' in params:
         filters.append({"term": {"ecommerce.is_ecommerce": True}})
 
     if 'exclude_tps' in params:
-        f = {"missing": {"field": "tps"}}
+        f = query_helpers.get_dialect().missing_filter("tps")
         filters.append(f)
 
     return filters
 
 
+def _sectors_filter(sectors):
+    """Match companies in any of the sectors, or below them in the taxonomy.
+
+    Large enough subtrees are matched by their path, a single term, rather
+    than by listing every sector in them.
+    """
+    taxonomy = get_sector_taxonomy()
+    if taxonomy is None:
+        return query_helpers.exact_matches(settings.SECTOR_ES_FIELD,
+                                           list(sectors))
+
+    min_subtree = settings.app_settings["sector_path_min_subtree"]
+    sector_ids = []
+    paths = []
+    for sector in sectors:
+        if min_subtree and taxonomy.subtree_size(sector) >= min_subtree:
+            paths.append(taxonomy.path(sector))
+        else:
+            sector_ids.extend(taxonomy.descendants(sector))
+
+    filters = []
+    if sector_ids:
+        filters.append(query_helpers.exact_matches(settings.SECTOR_ES_FIELD,
+                                                   sector_ids))
+    if paths:
+        filters.append(query_helpers.exact_matches(
+            settings.SECTOR_PATH_ES_FIELD, paths))
+    if len(filters) == 1:
+        return filters[0]
+    return query_helpers.get_dialect().or_filter(filters)
+
+
+TRADING_ACTIVITY_CHILD_DOCS = [
+    ('import_events', 'import_date'),
+    ('export_events', 'date'),
+]
+
+
+def _denormalized_activity_filter(doc_type, gte, lte):
+    """Match companies with doc_type events in a date range using the parent
+    level summary fields, or None if they can not answer the range exactly.
+
+    An event on or after gte exists if the last event is, an event on or
+    before lte if the first event is, and an event within whole months if
+    any of the months had one.
+    """
+    fields = settings.TRADING_ACTIVITY_DENORMALIZED_FIELDS[doc_type]
+    if gte and not lte:
+        return query_helpers.range_(fields["last"], gte, None)
+    if lte and not gte:
+        return query_helpers.range_(fields["first"], None, lte)
+    if gte and lte:
+        months = query_helpers.months_in_range(gte, lte)
+        if months is not None:
+            return query_helpers.exact_matches(fields["months"], months)
+    return None
+
+
+def _trading_activity_filter(gte, lte, cache=False):
+    """Match companies with import or export events in a date range."""
+    dialect = query_helpers.get_dialect()
+    denormalized = \
+        settings.app_settings["trading_activity_mode"] == "denormalized"
+    filters = []
+    for doc_type, date_name in TRADING_ACTIVITY_CHILD_DOCS:
+        if denormalized:
+            child_filter = _denormalized_activity_filter(doc_type, gte, lte)
+            if child_filter is not None:
+                filters.append(child_filter)
+                continue
+        cache_key = None
+        if cache:
+            cache_key = query_helpers.child_doc_cache_key(
+                doc_type, date_name, gte, lte)
+        filters.append(query_helpers.build_child_doc_filter(
+            doc_type, date_name, gte, lte, cache_key))
+    return dialect.or_filter(filters)
+
+
+@instrumented("filters.trading_activity_filters")
 @query_build_exception
 def trading_activity_filters(params):
-    """Add trading activity filters to query"""
+    """Add trading activity filters to query
+
+    With trading_activity_rounding set the dates are widened to whole
+    periods, so near identical requests share a cluster filter cache entry.
+    """
 
     filters = []
     if "trading_activity" in params:
         gte, lte = query_helpers.dates_for_date_range(params,
                                                       'trading_activity')
-        imports_filter = query_helpers.build_child_doc_filter(
-            'import_events', 'import_date', gte, lte)
-        exports_filter = query_helpers.build_child_doc_filter(
-            'export_events', 'date', gte, lte)
-        filters.append(imports_filter)
-        filters.append(exports_filter)
-        filters = [{"or": filters}]
+        rounding = settings.app_settings["trading_activity_rounding"]
+        if rounding:
+            gte, lte = query_helpers.round_date_range(gte, lte, rounding)
+        filters.append(_trading_activity_filter(gte, lte,
+                                                cache=bool(rounding)))
     return filters
 
-def cids_filters(params):
-    """Add CIDS to filters."""
 
-    if "cids" not in params:
+@instrumented("filters.trading_activity_post_filters")
+@query_build_exception
+def trading_activity_post_filters(params):
+    """Exact trading activity filters, when the main filters are rounded"""
+
+    app_settings = settings.app_settings
+    if "trading_activity" not in params or \
+            not app_settings["trading_activity_rounding"] or \
+            not app_settings["trading_activity_exact_post_filter"]:
         return []
 
-    cids_filter = {
-        "terms": {
-            "cid": params["cids"]
-        }
-    }
+    gte, lte = query_helpers.dates_for_date_range(params, 'trading_activity')
+    return [_trading_activity_filter(gte, lte)]
+
+@instrumented("filters.cids_filters")
+def cids_filters(params):
+    """Add CIDS to filters.
+
+    cids are given inline, cid_list references a stored id list document.
+    """
 
-    return [cids_filter]
+    filters = []
+    if "cids" in params:
+        filters.append({
+            "terms": {
+                "cid": list(params["cids"])
+            }
+        })
+
+    if "cid_list" in params:
+        lookup = dict(settings.CID_LIST_LOOKUP, id=params["cid_list"])
+        filters.append({
+            "terms": {
+                "cid": lookup
+            }
+        })
+
+    return filters
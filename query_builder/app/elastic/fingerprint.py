@@ -0,0 +1,55 @@
+"""Stable fingerprints of built ES queries.
+
+Two queries get the same fingerprint when they only differ in dict key
+order, or in the order of list items where order does not change the
+meaning of the query (filter lists, terms values).
+"""
+
+import collections
+import hashlib
+import json
+
+from query_builder.app.elastic.query_cache import ORDERED_KEYS
+
+# Top level keys which only select a page of the results
+PAGINATION_KEYS = frozenset(["from", "size", "search_after"])
+
+
+Fingerprints = collections.namedtuple("Fingerprints", ["full", "unpaged"])
+
+
+def normalize(query, ordered=False):
+    """Return query with dict keys sorted and unordered lists sorted."""
+    if isinstance(query, dict):
+        return collections.OrderedDict(
+            (key, normalize(query[key], key in ORDERED_KEYS))
+            for key in sorted(query))
+    if isinstance(query, (list, tuple)):
+        items = [normalize(item) for item in query]
+        if not ordered:
+            items.sort(key=_dumps)
+        return items
+    return query
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"))
+
+
+def fingerprint(query, include_pagination=True):
+    """Return a hex digest identifying query.
+
+    Args:
+        query: ES query as a python dict
+        include_pagination: if False, queries for different pages of the
+            same search share a fingerprint
+    """
+    if not include_pagination:
+        query = dict((key, value) for key, value in query.iteritems()
+                     if key not in PAGINATION_KEYS)
+    return hashlib.sha1(_dumps(normalize(query))).hexdigest()
+
+
+def fingerprints(query):
+    """Return the Fingerprints of query, with and without pagination."""
+    return Fingerprints(fingerprint(query), fingerprint(query, False))
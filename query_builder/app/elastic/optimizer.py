@@ -0,0 +1,160 @@
+"""Optimisation pass over the list of filters AND-ed into a query.
+
+The pass rewrites the list into an equivalent but cheaper one:
+
+    * tautologies such as match_all or unbounded ranges are dropped;
+    * sibling nested filters on the same path are merged into one nested
+      bool, so each nested document is only visited once;
+    * duplicate filters are removed, and terms filters on the same
+      single valued field (settings.SINGLE_VALUED_FIELDS) are intersected
+      into one. On a multi valued field such as sector.id a document with
+      values [1, 2] matches terms [1] AND terms [2], but not their empty
+      intersection, so those filters are kept apart;
+    * filters are ordered cheap first, according to a cost table.
+
+Both the legacy and bool dialects' filter shapes are understood.
+"""
+
+from query_builder.app.elastic.query_cache import canonical_key
+from query_builder.config import settings
+
+
+def _clause_type(filt):
+    if len(filt) == 1:
+        return next(iter(filt))
+    return None
+
+
+BOOL_CLAUSES = ("filter", "must", "should", "must_not")
+
+
+def _children(filt, clause_type):
+    """Sub-filters of a compound and / or / bool filter."""
+    if clause_type in ("and", "or"):
+        return filt[clause_type]
+    if clause_type == "bool":
+        return [child for clause in BOOL_CLAUSES
+                for child in filt["bool"].get(clause, [])]
+    return []
+
+
+def filter_cost(filt, cost_table):
+    """Estimated relative cost of executing a filter."""
+    clause_type = _clause_type(filt)
+    cost = cost_table.get(clause_type, cost_table["default"])
+    children = _children(filt, clause_type)
+    if children:
+        cost = max([cost] + [filter_cost(child, cost_table)
+                             for child in children])
+    return cost
+
+
+def is_tautology(filt):
+    """True for filters which match every document."""
+    if not filt:
+        return True
+    clause_type = _clause_type(filt)
+    if clause_type == "match_all":
+        return True
+    if clause_type == "range":
+        return all(not bounds for bounds in filt["range"].values())
+    if clause_type == "and":
+        return all(is_tautology(child) for child in filt["and"])
+    if clause_type == "bool" and set(filt["bool"]) <= {"filter", "must"}:
+        return all(is_tautology(child)
+                   for child in _children(filt, clause_type))
+    return False
+
+
+# (nested key, bool key) of mergeable nested filters in each dialect:
+# legacy {"nested": {"path": p, "filter": {"bool": {"must": [...]}}}}
+# bool   {"nested": {"path": p, "query": {"bool": {"filter": [...]}}}}
+NESTED_SHAPES = (("filter", "must"), ("query", "filter"))
+
+
+def _nested_clauses(filt):
+    """Return (merge key, clauses) of a mergeable nested filter, or None."""
+    if _clause_type(filt) != "nested":
+        return None
+    nested = filt["nested"]
+    for inner_key, bool_key in NESTED_SHAPES:
+        if set(nested) != {"path", inner_key}:
+            continue
+        inner = nested[inner_key]
+        if _clause_type(inner) == "bool" and set(inner["bool"]) == {bool_key}:
+            return ((nested["path"], inner_key, bool_key),
+                    inner["bool"][bool_key])
+    return None
+
+
+def merge_nested(filters):
+    """Merge sibling nested bool filters on the same path."""
+    merged = []
+    by_key = {}
+    for filt in filters:
+        nested = _nested_clauses(filt)
+        if nested is None:
+            merged.append(filt)
+            continue
+        key, clauses = nested
+        if key in by_key:
+            by_key[key].extend(clauses)
+            continue
+        clauses = list(clauses)
+        by_key[key] = clauses
+        path, inner_key, bool_key = key
+        merged.append({
+            "nested": {
+                "path": path,
+                inner_key: {
+                    "bool": {
+                        bool_key: clauses
+                    }
+                }
+            }
+        })
+    return merged
+
+
+def collapse_duplicates(filters, single_valued_fields=None):
+    """Remove repeated filters and intersect terms filters on one single
+    valued field."""
+    if single_valued_fields is None:
+        single_valued_fields = settings.SINGLE_VALUED_FIELDS
+    collapsed = []
+    seen = set()
+    terms_by_field = {}
+    for filt in filters:
+        if _clause_type(filt) == "terms" and len(filt["terms"]) == 1:
+            field, values = next(filt["terms"].iteritems())
+            if isinstance(values, list) and field in single_valued_fields:
+                if field in terms_by_field:
+                    existing = terms_by_field[field]
+                    allowed = set(values)
+                    existing[:] = [v for v in existing if v in allowed]
+                    continue
+                values = list(values)
+                terms_by_field[field] = values
+                filt = {"terms": {field: values}}
+
+        key = canonical_key(filt)
+        if key in seen:
+            continue
+        seen.add(key)
+        collapsed.append(filt)
+    return collapsed
+
+
+def order_by_cost(filters, cost_table=None):
+    """Return filters ordered cheap first."""
+    cost_table = cost_table or settings.FILTER_COSTS
+    # sorted is stable, so equal cost filters keep their code order
+    return sorted(filters, key=lambda filt: filter_cost(filt, cost_table))
+
+
+def optimize_filters(filters, cost_table=None):
+    """Return an equivalent, cheaper list of AND-ed filters."""
+    filters = [filt for filt in filters if not is_tautology(filt)]
+    filters = merge_nested(filters)
+    filters = collapse_duplicates(filters)
+    return order_by_cost(filters, cost_table)
@@ -1,6 +1,7 @@
 """ES querying layer."""
 
 
+import atexit
 import datetime
 import json
 import logging
@@ -10,63 +11,274 @@ import os
 from query_builder.config import settings
 from query_builder import __file__ as api_path
 from query_builder.app.elastic import companies_search
+from query_builder.app.elastic.executor import ESExecutor
+from query_builder.app.elastic.fingerprint import fingerprints
+from query_builder.app.elastic.query_cache import (QueryCache, canonical_key,
+                                                   copy_query)
+from query_builder.app.elastic.query_log import AsyncQueryLogWriter
+from query_builder.app.instrumentation import instrumented
 
 api_version = settings.app_settings["version"]
 
 
 
+_loggers_configured = False
+
+
+def _configure_loggers(api_directory):
+    """Attach the file handlers to the module loggers once per process.
+
+    Piston instances are cheap to create, but the loggers they write to are
+    process wide: adding handlers on every instantiation would duplicate each
+    log line once per Piston ever created.
+    """
+    global _loggers_configured
+    if _loggers_configured:
+        return
+
+    log_directory = "{0}/logs".format(api_directory)
+    if not os.path.isdir(log_directory):
+        os.makedirs(log_directory)
+
+    log = logging.getLogger("query_builder.piston")
+    log.setLevel(logging.DEBUG)
+    log_path = "{0}/query_builder.piston.log".format(log_directory)
+    log.addHandler(logging.FileHandler(log_path))
+
+    log_format = ("%(asctime)s - "
+                  "v{0} - %(levelname)s - %(message)s".format(api_version))
+    queries_log = logging.getLogger("query_builder.piston.queries")
+    queries_log.setLevel(logging.DEBUG)
+    queries_log.propagate = False
+    log_path = "{0}/query_builder.piston.queries.log".format(log_directory)
+    f_handler = logging.FileHandler(log_path)
+    f_handler.setFormatter(logging.Formatter(log_format))
+    queries_log.addHandler(f_handler)
+
+    _loggers_configured = True
+
+
+_async_log_writer = None
+_query_cache = None
+_executor = None
+
+
+def _date_handler(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    return None
+
+
+def _get_async_log_writer():
+    """Return the process wide async query log writer, starting it if needed."""
+    global _async_log_writer
+    if _async_log_writer is None:
+        app_settings = settings.app_settings
+        _async_log_writer = AsyncQueryLogWriter(
+            logging.getLogger("query_builder.piston.queries"),
+            max_queue_size=app_settings["query_log_queue_size"],
+            batch_size=app_settings["query_log_batch_size"],
+            flush_interval=app_settings["query_log_flush_interval"],
+            sample_rate=app_settings["query_log_sample_rate"],
+            overload_policy=app_settings["query_log_overload_policy"],
+            json_default=_date_handler)
+        atexit.register(_async_log_writer.close)
+    return _async_log_writer
+
+
+def _get_query_cache():
+    """Return the process wide query cache, or None if caching is disabled."""
+    global _query_cache
+    if _query_cache is None and settings.app_settings["query_cache_size"]:
+        _query_cache = QueryCache(settings.app_settings["query_cache_size"])
+    return _query_cache
+
+
+def _get_executor():
+    """Return the process wide ES executor, starting it if needed."""
+    global _executor
+    if _executor is None:
+        app_settings = settings.app_settings
+        _executor = ESExecutor(
+            settings.ES_URL, settings.ES_COMPANIES_INDEX,
+            doc_type=settings.ES_COMPANIES_DOC_TYPE,
+            pool_size=app_settings["es_pool_size"],
+            timeout=app_settings["es_timeout"],
+            retries=app_settings["es_retries"],
+            batch_window=app_settings["es_batch_window"],
+            max_batch_size=app_settings["es_max_batch_size"])
+        atexit.register(_executor.close)
+    return _executor
+
+
+def reset_process_state():
+    """Forget the process wide log writer and executor.
+
+    For use in forked children, where the parent's background threads no
+    longer exist; replacements are started on first use.
+    """
+    global _async_log_writer, _executor
+    _async_log_writer = None
+    _executor = None
+
+
+def _output_settings():
+    """Settings which change the query built for a given params dict.
+
+    Part of every query cache key, so changing any of them at runtime never
+    serves a query built under the old value. The structured settings which
+    also shape queries (FILTER_COSTS, SINGLE_VALUED_FIELDS, CID_LIST_LOOKUP,
+    COMPANIES_AGGREGATIONS, TRADING_ACTIVITY_DENORMALIZED_FIELDS and
+    CURSOR_SORT) are too costly to key on per request: call
+    clear_query_cache after changing them.
+    """
+    app_settings = settings.app_settings
+    return (settings.ES_DIALECT,
+            app_settings["optimize_filters"],
+            app_settings["trading_activity_rounding"],
+            app_settings["trading_activity_exact_post_filter"],
+            app_settings["trading_activity_mode"],
+            settings.SECTOR_TAXONOMY_PATH,
+            app_settings["sector_path_min_subtree"],
+            settings.SECTOR_ES_FIELD,
+            settings.SECTOR_PATH_ES_FIELD)
+
+
+def clear_query_cache():
+    """Empty the process wide query cache, if enabled."""
+    if _query_cache is not None:
+        _query_cache.clear()
+
+
 class Piston(object):
     """Logic for converting parameter dictionaries into Elasticsearch Query"""
 
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, log_writer=None, query_cache=None,
+                 executor=None):
 
         api_directory = os.path.dirname(os.path.abspath(api_path))
+        _configure_loggers(api_directory)
         if logger:
             self.log = logger
         else:
             self.log = logging.getLogger("query_builder.piston")
-            self.log.setLevel(logging.DEBUG)
-            log_path = "{0}/logs/query_builder.piston.log".format(api_directory)
-            f_handler = logging.FileHandler(log_path)
-            self.log.addHandler(f_handler)
 
-        log_format = ("%(asctime)s - "
-                      "v{0} - %(levelname)s - %(message)s".format(api_version))
         self.queries_log = logging.getLogger("query_builder.piston.queries")
-        self.queries_log.setLevel(logging.DEBUG)
-        self.queries_log.propagate = False
-        log_path = "{0}/logs/query_builder.piston.queries.log".format(api_directory)
-        f_handler = logging.FileHandler(log_path)
-        formatter = logging.Formatter(log_format)
-        f_handler.setFormatter(formatter)
-        self.queries_log.addHandler(f_handler)
-        self.dthandler = (lambda obj: obj.isoformat()
-                            if isinstance(obj, datetime.datetime) or
-                               isinstance(obj, datetime.date)
-                            else None)
+        self.dthandler = _date_handler
+
+        if log_writer is None and \
+                settings.app_settings["query_log_mode"] == "async":
+            log_writer = _get_async_log_writer()
+        self.log_writer = log_writer
+        if query_cache is None:
+            query_cache = _get_query_cache()
+        self.query_cache = query_cache
+        self._executor = executor
 
 
     def _log_query(self, query):
         """Write ES query to log file.
 
         Args:
-            query: ES query as a python dict
+            query: ES query as a python dict, or already serialised JSON
         """
+        if self.log_writer is not None:
+            # Serialised later on the writer thread, so queue a private copy
+            # the caller is free to mutate the query it gets back
+            self.log_writer.write("company", copy_query(query))
+            return
+
+        if not isinstance(query, basestring):
+            query = json.dumps(query, default=self.dthandler)
         self.queries_log.debug("doc_type: {0}, query: {1}".format("company",
-                            json.dumps(query, default=self.dthandler)))
+                            query))
+
+    @property
+    def executor(self):
+        """ES executor, only started when a search is first executed."""
+        if self._executor is None:
+            self._executor = _get_executor()
+        return self._executor
 
+    def _build(self, params, builder, output):
+        """Build a query with builder, going through the cache if enabled."""
+        if self.query_cache is None:
+            return builder(params)
+
+        cache_key = (output, _output_settings(), canonical_key(params))
+        es_query = self.query_cache.get(cache_key)
+        if es_query is None:
+            es_query = builder(params)
+            self.query_cache.put(cache_key, es_query)
+        return es_query
 
-    def company_search(self, params):
+
+    @instrumented("piston.company_search")
+    def company_search(self, params, fingerprint=False):
         """Search for companies by any parameter.
 
         Arguments:
             params: dictionary of params.
+            fingerprint: also return the query's Fingerprints.
         Returns:
             list of _source documents returned by ES.
         """
-        # Build the query from the params
-        es_query = companies_search.query_builder(params)
+        # Build the query from the params, unless an equivalent one is cached
+        es_query = self._build(params, companies_search.query_builder, "dict")
         self._log_query(es_query)
 
+        if fingerprint:
+            return es_query, fingerprints(es_query)
+        return es_query
+
+    @instrumented("piston.company_search_json")
+    def company_search_json(self, params):
+        """As company_search, but returns the query as compact JSON bytes.
+
+        The query is serialised once and the same bytes are written to the
+        query log.
+        """
+        es_query = self._build(params, companies_search.query_builder_json,
+                               "json")
+        self._log_query(es_query)
 
         return es_query
+
+    @instrumented("piston.company_search_handle")
+    def company_search_handle(self, params):
+        """As company_search, but returns a QueryHandle whose query can be
+        cheaply updated with company_search_patch.
+        """
+        handle = companies_search.build_query_handle(params)
+        self._log_query(handle.query)
+
+        return handle
+
+    @instrumented("piston.company_search_patch")
+    def company_search_patch(self, handle, delta):
+        """Update a previously built query with a change of parameters.
+
+        Arguments:
+            handle: QueryHandle from company_search_handle or a previous patch.
+            delta: dict of parsed params to set, a None value removing the key.
+        Returns:
+            QueryHandle of the updated query, its query in handle.query.
+        """
+        handle = companies_search.patch_query(handle, delta)
+        self._log_query(handle.query)
+
+        return handle
+
+    @instrumented("piston.company_search_results")
+    def company_search_results(self, params):
+        """Build the query for params and execute it.
+
+        Arguments:
+            params: dictionary of params.
+        Returns:
+            list of _source documents returned by ES.
+        """
+        es_query = self.company_search_json(params)
+        response = self.executor.search(es_query)
+
+        return [hit["_source"] for hit in response["hits"]["hits"]]
@@ -0,0 +1,95 @@
+"""LRU cache of built ES queries."""
+
+import collections
+import threading
+
+from query_builder.app.values import VALUE_TYPES
+
+
+# Keys whose list values are ordered
+ORDERED_KEYS = frozenset(["sort", "search_after"])
+
+
+def canonical_key(params, ordered=False):
+    """Return a hashable, order-insensitive key for a params dict.
+
+    Dict keys are sorted and list values, other than those of ORDERED_KEYS,
+    are treated as sets of values, so cid=1&cid=2 and cid=2&cid=1 share a
+    key. Parameter value objects are already canonical.
+    """
+    if isinstance(params, VALUE_TYPES):
+        return params
+    if isinstance(params, dict):
+        return tuple(sorted((key, canonical_key(value, key in ORDERED_KEYS))
+                            for key, value in params.iteritems()))
+    if isinstance(params, (list, tuple)):
+        values = tuple(canonical_key(value) for value in params)
+        return values if ordered else tuple(sorted(values))
+    return params
+
+
+def copy_query(query):
+    """Copy a JSON-like tree of dicts and lists.
+
+    Much cheaper than copy.deepcopy since leaves are immutable scalars.
+    """
+    if isinstance(query, dict):
+        return {key: copy_query(value) for key, value in query.iteritems()}
+    if isinstance(query, list):
+        return [copy_query(value) for value in query]
+    return query
+
+
+class QueryCache(object):
+    """Size-bounded, thread-safe LRU mapping of params keys to queries.
+
+    Values are stored and returned as private copies, so callers are free to
+    mutate what they get back.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def get(self, key):
+        """Return a copy of the cached query for key, or None."""
+        with self._lock:
+            try:
+                query = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries[key] = query
+            self.hits += 1
+        return copy_query(query)
+
+    def put(self, key, query):
+        """Store a copy of query under key, evicting the oldest entries."""
+        query = copy_query(query)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = query
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -2,6 +2,10 @@
 Helper functions for building elasticsearch queries and filters.
 """
 
+import datetime
+
+from query_builder.app.elastic.dialects import get_dialect
+
 
 def dates_for_date_range(params, dates_key):
     """Construct dates for a date range filter or query
@@ -10,17 +14,71 @@ def dates_for_date_range(params, dates_key):
         params: query parameters dict
         dates_key: the 'type' of dates to be looked for
     """
-    gte = None
-    lte = None
-
     if dates_key in params:
-        gte = params[dates_key].get("gte", None)
-        lte = params[dates_key].get("lte", None)
+        date_range = params[dates_key]
+        return date_range.gte, date_range.lte
+
+    return None, None
+
+
+ROUNDING_PERIOD_MONTHS = {
+    "month": 1,
+    "quarter": 3,
+    "year": 12,
+}
+
+
+def _period_start(date, months):
+    month = (date.month - 1) // months * months + 1
+    return datetime.date(date.year, month, 1)
 
+
+def round_date_range(gte, lte, period):
+    """Widen an ISO date range outwards to whole periods
+
+    Args:
+        gte: the 'from' date, rounded down to the start of its period
+        lte: the 'to' date, rounded up to the end of its period
+        period: one of ROUNDING_PERIOD_MONTHS
+    """
+    months = ROUNDING_PERIOD_MONTHS[period]
+    if gte:
+        date = datetime.datetime.strptime(gte, "%Y-%m-%d").date()
+        gte = _period_start(date, months).isoformat()
+    if lte:
+        date = datetime.datetime.strptime(lte, "%Y-%m-%d").date()
+        start = _period_start(date, months)
+        month = start.month - 1 + months
+        next_start = datetime.date(start.year + month // 12, month % 12 + 1, 1)
+        lte = (next_start - datetime.timedelta(days=1)).isoformat()
     return gte, lte
 
 
-def build_child_doc_filter(doc_type, date_name, gte, lte):
+def months_in_range(gte, lte):
+    """List the "YYYY-MM" months of an ISO date range covering whole months
+
+    Returns None if gte is not the first day of a month or lte is not the
+    last day of a month.
+    """
+    start = datetime.datetime.strptime(gte, "%Y-%m-%d").date()
+    end = datetime.datetime.strptime(lte, "%Y-%m-%d").date()
+    if start.day != 1 or (end + datetime.timedelta(days=1)).day != 1:
+        return None
+
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append("{:04d}-{:02d}".format(year, month))
+        year, month = year + month // 12, month % 12 + 1
+    return months
+
+
+def child_doc_cache_key(doc_type, date_name, gte, lte):
+    """Cluster filter cache key for a child document date range filter"""
+    return "{}:{}:{}:{}".format(doc_type, date_name, gte or "", lte or "")
+
+
+def build_child_doc_filter(doc_type, date_name, gte, lte, cache_key=None):
     """Construct a child document filter
 
     Args:
@@ -28,25 +86,12 @@ def build_child_doc_filter(doc_type, date_name, gte, lte):
         date_name: the name of the date to filter by
         gte: the 'from' date
         lte: the 'to' date
+        cache_key: cluster filter cache key of the child side filter, if it
+            should be cached
     """
 
-    child_doc_filter = {
-        "has_child": {
-            "type": doc_type,
-            "filter": {
-                "and": [
-                    {
-                        "range": {
-                            date_name: {
-                                "gte": gte,
-                                "lte": lte
-                            }
-                        }
-                    }
-                ]
-            }
-        }
-    }
+    child_doc_filter = get_dialect().child_doc_filter(doc_type, date_name,
+                                                      gte, lte, cache_key)
 
     return child_doc_filter
 
@@ -69,40 +114,27 @@ def range_(variable, gte, lte):
     return query
 
 
-def financial_filters_range(financial_field, range_dict):
+def financial_filters_range(financial_field, value_range):
     """Create a range query for Elasticsearch using latest financials where
-       range_dict contains:
-        {
-            "gte": <lower_bound>,
-            "lte": <upper_bound>,
-        }
+       value_range is a Range of <lower_bound>, <upper_bound>
     """
     ranges = {}
-    lower_bound = range_dict.get('gte')
-    upper_bound = range_dict.get('lte')
+    lower_bound = value_range.gte
+    upper_bound = value_range.lte
     # if lower bound is zero don't add it - we want to include negative values
     if lower_bound:
         ranges['gte'] = lower_bound
     if upper_bound is not None:
-        ranges['lte'] = range_dict.get('lte')
+        ranges['lte'] = upper_bound
 
     range_field = "financial_filters.{}".format(financial_field)
-    query = {
-        "nested": {
-            "path": "financial_filters",
-            "filter": {
-                "bool": {
-                    "must": [
-                        {
-                            "range": {
-                                range_field: ranges
-                            }
-                        }
-                    ]
-                }
+    query = get_dialect().nested_filter("financial_filters", [
+        {
+            "range": {
+                range_field: ranges
             }
         }
-    }
+    ])
     return query
 
 
@@ -0,0 +1,169 @@
+"""Non-blocking writer for the ES query log."""
+
+import json
+import logging
+import random
+import threading
+import time
+import Queue
+
+
+OVERLOAD_DROP = "drop"
+OVERLOAD_BLOCK = "block"
+
+
+class AsyncQueryLogWriter(object):
+    """Queue-backed writer for the queries log.
+
+    Callers only pay for an enqueue: serialisation, formatting and the file
+    write happen on a background thread which drains the queue in batches and
+    flushes each handler once per batch.
+
+    Args:
+        logger: logger whose handlers the records are written to
+        max_queue_size: number of records buffered before overload
+        batch_size: maximum number of records written per flush
+        flush_interval: seconds to wait for a batch to fill up
+        sample_rate: fraction of queries logged, between 0 and 1
+        overload_policy: OVERLOAD_DROP to discard records when the buffer is
+            full, OVERLOAD_BLOCK to make the caller wait for space
+        json_default: fallback serialiser passed to json.dumps
+    """
+
+    def __init__(self, logger, max_queue_size=10000, batch_size=500,
+                 flush_interval=0.2, sample_rate=1.0,
+                 overload_policy=OVERLOAD_DROP, json_default=None):
+        if overload_policy not in (OVERLOAD_DROP, OVERLOAD_BLOCK):
+            raise ValueError("Unknown overload policy: {}".format(
+                overload_policy))
+        self.logger = logger
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rate = sample_rate
+        self.overload_policy = overload_policy
+        self.json_default = json_default
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.errors = 0
+
+        self._queue = Queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        # Held while enqueueing records, updating the caller side counters
+        # and marking the writer closed, so no record is queued behind the
+        # stop sentinel. The writer thread never takes it, so a blocking put
+        # under OVERLOAD_BLOCK still completes as the queue drains.
+        self._close_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run,
+                                        name="query-log-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def stats(self):
+        return {
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+            "errors": self.errors,
+            "pending": self._queue.qsize(),
+        }
+
+    def write(self, doc_type, query):
+        """Queue a query for logging. Never blocks under OVERLOAD_DROP.
+
+        The query is serialised on the writer thread, so it must not be
+        mutated after being handed over.
+        """
+        item = (time.time(), doc_type, query)
+        with self._close_lock:
+            if self._closed:
+                self.dropped += 1
+                return
+            if self.sample_rate < 1.0 and \
+                    random.random() >= self.sample_rate:
+                self.sampled_out += 1
+                return
+
+            if self.overload_policy == OVERLOAD_BLOCK:
+                self._queue.put(item)
+            else:
+                try:
+                    self._queue.put_nowait(item)
+                except Queue.Full:
+                    self.dropped += 1
+                    return
+            self.enqueued += 1
+
+    def flush(self):
+        """Block until every queued record has been written."""
+        self._queue.join()
+
+    def close(self):
+        """Write out pending records and stop the writer thread."""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.flush_interval
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except Queue.Empty:
+                    break
+
+            stop = batch[-1] is None
+            records = [item for item in batch if item is not None]
+            try:
+                self._write_batch(records)
+            except Exception:
+                self.errors += len(records)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _make_record(self, created, doc_type, query):
+        if isinstance(query, basestring):
+            serialized = query
+        else:
+            serialized = json.dumps(query, default=self.json_default)
+        record = self.logger.makeRecord(
+            self.logger.name, logging.DEBUG, __file__, 0,
+            "doc_type: {0}, query: {1}".format(doc_type, serialized),
+            (), None)
+        record.created = created
+        record.msecs = (created - int(created)) * 1000
+        return record
+
+    def _write_batch(self, records):
+        if not records:
+            return
+        records = [self._make_record(*item) for item in records]
+        for handler in self.logger.handlers:
+            stream = getattr(handler, "stream", None)
+            if stream is None:
+                for record in records:
+                    handler.handle(record)
+                continue
+            handler.acquire()
+            try:
+                stream.write("".join(handler.format(record) + "\n"
+                                     for record in records))
+                stream.flush()
+            finally:
+                handler.release()
+        self.written += len(records)
@@ -1 +1,2 @@
-from .company_query_builder import CompanyQueryBuilder
\ No newline at end of file
+from .company_query_builder import CompanyQueryBuilder
+from .batch import BatchQueryBuilder, BatchResult
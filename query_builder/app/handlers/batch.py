@@ -0,0 +1,63 @@
+import collections
+import logging
+
+from query_builder import exceptions
+from query_builder.app.elastic.piston import Piston
+from query_builder.app.handlers.company_query_builder import CompanyQueryBuilder
+
+log = logging.getLogger("query_builder.batch")
+
+
+class BatchResult(collections.namedtuple("BatchResult",
+                                         ["url", "query", "error"])):
+    """Outcome of translating a single URL in a batch.
+
+    Exactly one of query and error is set.
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class BatchQueryBuilder(object):
+    """Long-lived builder for translating many request URLs.
+
+    A single Piston (and therefore a single logging setup) is shared by every
+    URL translated through this object.
+    """
+
+    def __init__(self, piston=None):
+        self.piston = piston or Piston()
+
+    def build(self, url, as_json=False, body_params=None):
+        """Return the ES query for url, raising on invalid requests.
+
+        With as_json the query is returned as compact JSON bytes.
+        body_params are merged into the URL's query parameters.
+        """
+        handler = CompanyQueryBuilder(url, piston=self.piston,
+                                      body_params=body_params)
+        if as_json:
+            return handler.get_json()
+        return handler.get()
+
+    def build_many(self, urls, as_json=False):
+        """Translate an iterable of URLs, yielding a BatchResult per URL.
+
+        Client and query building errors are reported on the result rather
+        than raised, so one bad URL does not abort the batch. Any other
+        error is logged and reported on its result as an internal error.
+        """
+        for url in urls:
+            try:
+                yield BatchResult(url, self.build(url, as_json), None)
+            except exceptions.ClientError as e:
+                yield BatchResult(url, None, e.msg)
+            except exceptions.ESQueryError as e:
+                yield BatchResult(url, None, e.details)
+            except Exception as e:
+                log.exception("Unexpected error for %r", url)
+                yield BatchResult(url, None, u"Internal error: {}".format(
+                    exceptions.to_text(e)))
@@ -1,29 +1,134 @@
 from __future__ import unicode_literals
 
+import base64
+import json
+
+from query_builder import exceptions
+from query_builder.app.values import PageWindow
 from query_builder.config.app import settings
 
+# cursor value requesting the first page of a cursor paginated search
+CURSOR_START = "start"
+
+
+def encode_cursor(sort_values):
+    """Return an opaque cursor token for the sort values of the last hit."""
+    return base64.urlsafe_b64encode(
+        json.dumps(sort_values, separators=(",", ":"))).rstrip(b"=")
+
+
+def decode_cursor(token):
+    """Return the sort values encoded in a cursor token."""
+    try:
+        padded = str(token) + b"=" * (-len(token) % 4)
+        sort_values = json.loads(base64.urlsafe_b64decode(padded))
+    except (TypeError, ValueError, UnicodeError):
+        raise exceptions.ParameterValueError(key="cursor", value=token)
+    if not isinstance(sort_values, list) or \
+            len(sort_values) != len(settings.CURSOR_SORT):
+        raise exceptions.ParameterValueError(key="cursor", value=token)
+    return sort_values
+
+
+def next_cursor(response, page_size):
+    """Cursor for the page after an ES response, or None on the last page."""
+    hits = response["hits"]["hits"]
+    if len(hits) < page_size or not hits:
+        return None
+    return encode_cursor(hits[-1]["sort"])
+
+
+def _parse_int(key, value, default):
+    """Integer value of a pagination argument, default if it is not set."""
+    if not value:
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise exceptions.ParameterValueError(
+            key=key, value=value, message="must be an integer")
+
+
 class Pagination(object):
     DEFAULT_RESULTS_LIMIT = settings.app_settings["results_limit_default"]
     PAGE_SIZE_DEFAULT = settings.app_settings["page_size_default"]
+    CURSOR_PAGE_SIZE_MAX = settings.app_settings["cursor_page_size_max"]
 
-    def __init__(self, limit, offset):
-        self._limit = int(limit) if limit else None
-        self._offset = int(offset) if offset else 0
+    def __init__(self, limit, offset, cursor=None):
+        self._limit = _parse_int("limit", limit, None)
+        self._offset = _parse_int("offset", offset, 0)
+        self.cursor = cursor
+        if cursor is not None:
+            self._validate_cursor_args(limit)
+        self.response_limit = self._calculate_limit(self.DEFAULT_RESULTS_LIMIT,
+                                                    self.DEFAULT_RESULTS_LIMIT)
+        self.window = self._calculate_window()
+
+    @property
+    def search_after(self):
+        """Sort values to continue after, None for first or offset pages."""
+        if self.window.search_after is None:
+            return None
+        return list(self.window.search_after)
 
     @property
     def page_size(self):
-        return min(abs(self.response_limit - self._offset), self.PAGE_SIZE_DEFAULT)
+        return self.window.size
 
     @property
     def page_offset(self):
+        return self.window.offset
+
+    def add_to_params(self, params):
+        """Add the pagination parameters to a parsed params dict.
+
+        Cursor pages are not subject to the results limit: each page
+        continues from the sort values of the previous page's last hit.
+        """
+        if self.cursor is None:
+            params["size"] = self.window.size
+            params["from"] = self.window.offset
+            return params
+
+        params["size"] = self.window.size
+        params["sort"] = [dict(sort) for sort in settings.CURSOR_SORT]
+        if self.window.search_after is not None:
+            params["search_after"] = self.search_after
+        return params
+
+    def _validate_cursor_args(self, limit):
+        """Cursor pages use search_after, which needs Elasticsearch 5.0+ and
+        so the bool dialect: the legacy dialect's filters were removed in 5.0.
+        """
+        if settings.ES_DIALECT != "bool":
+            raise exceptions.ParameterValueError(
+                key="cursor", value=self.cursor,
+                message="cursor pagination requires the bool dialect")
+        if self._offset:
+            raise exceptions.ParameterValueError(
+                key="offset", value=self._offset,
+                message="offset can not be combined with cursor")
+        if self._limit is not None and self._limit < 1:
+            raise exceptions.ParameterValueError(
+                key="limit", value=limit, message="must be positive")
+
+    def _calculate_window(self):
+        """Returns the PageWindow for the requested limit, offset and cursor."""
+        if self.cursor is not None:
+            size = min(self._limit or self.PAGE_SIZE_DEFAULT,
+                       self.CURSOR_PAGE_SIZE_MAX)
+            search_after = None
+            if self.cursor != CURSOR_START:
+                search_after = tuple(decode_cursor(self.cursor))
+            return PageWindow(size, None, self.cursor, search_after)
+
+        size = min(abs(self.response_limit - self._offset),
+                   self.PAGE_SIZE_DEFAULT)
         # e.g. if the max response limit is 500 and page size is 50, the
         # max offset is 450
         max_possible_offset = abs(self.response_limit - self.PAGE_SIZE_DEFAULT)
-        return min(self._offset, max_possible_offset)
-
-    @property
-    def response_limit(self):
-        return self._calculate_limit(self.DEFAULT_RESULTS_LIMIT, self.DEFAULT_RESULTS_LIMIT)
+        offset = min(self._offset, max_possible_offset)
+        return PageWindow(size, offset, None, None)
 
     def _calculate_limit(self, default_limit, max_limit):
         """Returns default if no limit set, else returns minimum of requested
@@ -0,0 +1,218 @@
+"""Declarative URL parameter schema, compiled into a dispatch table."""
+
+import datetime
+import re
+
+from query_builder import exceptions
+from query_builder.app.taxonomy import get_sector_taxonomy
+from query_builder.app.values import DateRange, IdSet, Range
+from query_builder.config.app import settings
+
+
+RANGE_EXP = re.compile(r"^(\-?[0-9]+)?\-(\-?[0-9]+)?$")
+BOOLEAN_INT_EXP = re.compile(r"^[0-1]$")
+# Not str.isdigit, which accepts unicode digits int() cannot parse
+ID_EXP = re.compile(r"^[0-9]+$")
+BOOLEAN_VALUES = {"true": True, "false": False}
+
+
+def parse_range(name, values):
+    """Parser for arguments that are numerical range types.
+
+    Expect an argument of the format: n-N
+    Returns a Range, or None if neither bound is set.
+    Negative values are permitted."""
+    value = values[-1]
+    m = RANGE_EXP.match(value)
+    if not m:
+        raise exceptions.ParameterValueError(key=name, value=value)
+
+    lbound = int(m.group(1)) if m.group(1) else None
+    ubound = int(m.group(2)) if m.group(2) else None
+
+    if lbound is not None and ubound is not None and lbound > ubound:
+        raise exceptions.ParameterValueError(key=name, value=value)
+
+    if lbound or ubound:
+        return Range(lbound, ubound)
+    return None
+
+
+def parse_date(name, value):
+    """Parse a YYYYMMDD date into an ISO date string."""
+    if value:
+        try:
+            return datetime.datetime.strptime(
+                value, '%Y%m%d').date().isoformat()
+        except ValueError as e:
+            raise exceptions.ParameterValueError(key=name, value=value,
+                                                 message=str(e))
+
+
+def parse_date_range(name, values):
+    """Parse a date range of the format YYYYMMDD-YYYYMMDD.
+
+    Either end may be omitted."""
+    value = values[-1]
+    try:
+        datefrom, dateto = value.split('-')
+    except ValueError:
+        raise exceptions.ParameterValueError(key=name, value=value)
+
+    return DateRange(parse_date(name, datefrom) or None,
+                     parse_date(name, dateto) or None)
+
+
+def parse_boolean(name, values):
+    """Parse boolean argument types: 0, 1, true or false."""
+    value = values[-1]
+    if BOOLEAN_INT_EXP.match(value):
+        return bool(int(value))
+    try:
+        return BOOLEAN_VALUES[value.lower()]
+    except KeyError:
+        raise exceptions.ParameterValueError(key=name, value=value)
+
+
+def parse_flag(name, values):
+    """Parse a boolean argument which is only included when true."""
+    return parse_boolean(name, values) or None
+
+
+def parse_multi_value(name, values):
+    """Arguments which may be repeated e.g. &sector_context=1&sector_context=2"""
+    return values
+
+
+def parse_id_list(name, values):
+    """Repeatable integer id arguments e.g. &cid=1&cid=2
+
+    Ids are validated in bulk, deduplicated and returned in numerical order,
+    so large lists stay compact and equivalent lists compare equal."""
+    if not ID_EXP.match("".join(values)):
+        for value in values:
+            if not ID_EXP.match(value):
+                raise exceptions.ParameterValueError(
+                    key=name, value=value, message="ids must be integers")
+    return IdSet(str(value) for value in sorted(set(int(v) for v in values)))
+
+
+def parse_sector_ids(name, values):
+    """Sectors e.g. &sector_context=1&sector_context=2
+
+    With a sector taxonomy configured, unknown ids are rejected and the
+    sectors are reduced to the tops of the subtrees they select. Without one
+    the values are passed through."""
+    taxonomy = get_sector_taxonomy()
+    if taxonomy is None:
+        return values
+    for value in values:
+        if value not in taxonomy:
+            raise exceptions.ParameterValueError(
+                key=name, value=value, message="unknown sector")
+    return IdSet(taxonomy.subtree_roots(values))
+
+
+def parse_source_fields(name, values):
+    """Document fields to return, e.g. &fields=cid,name&fields=sector
+
+    Fields must be in settings.COMPANIES_SOURCE_FIELDS, or be sub-fields of
+    one of them. Returned in request order without duplicates."""
+    whitelist = settings.COMPANIES_SOURCE_FIELDS
+    fields = []
+    for value in values:
+        for field in value.split(","):
+            field = field.strip()
+            if not field or field in fields:
+                continue
+            if field not in whitelist and \
+                    field.split(".", 1)[0] not in whitelist:
+                raise exceptions.ParameterValueError(
+                    key=name, value=field, message="unknown field")
+            fields.append(field)
+    return fields or None
+
+
+def parse_aggregation_names(name, values):
+    """Aggregations to compute, e.g. &aggregation=sectors&aggregation=revenue
+
+    Names must be in settings.COMPANIES_AGGREGATIONS. Returned in request
+    order without duplicates."""
+    names = []
+    for value in values:
+        if value not in settings.COMPANIES_AGGREGATIONS:
+            raise exceptions.ParameterValueError(
+                key=name, value=value, message="unknown aggregation")
+        if value not in names:
+            names.append(value)
+    return names
+
+
+def parse_string(name, values):
+    """Single valued string arguments."""
+    return values[-1]
+
+
+PARSERS = {
+    "range": parse_range,
+    "date_range": parse_date_range,
+    "boolean": parse_boolean,
+    "flag": parse_flag,
+    "multi_value": parse_multi_value,
+    "id_list": parse_id_list,
+    "sector_ids": parse_sector_ids,
+    "string": parse_string,
+    "source_fields": parse_source_fields,
+    "aggregations": parse_aggregation_names,
+    "pagination": None,
+}
+
+# Values set in parsed_params when the argument is not supplied
+DEFAULTS = {
+    "boolean": None,
+}
+
+
+class ParameterSchema(object):
+    """Compiled form of a parameter schema such as
+    settings.COMPANIES_PARAMETERS.
+
+    parse walks the supplied parameters once, validating and converting each
+    through its dispatch table entry.
+    """
+
+    def __init__(self, parameters):
+        self.dispatch = {}
+        self.defaults = {}
+        for name, param_type, key in parameters:
+            try:
+                parser = PARSERS[param_type]
+            except KeyError:
+                raise ValueError("Unknown parameter type '{}' for '{}'".format(
+                    param_type, name))
+            self.dispatch[name] = (parser, key or name)
+            if param_type in DEFAULTS:
+                self.defaults[key or name] = DEFAULTS[param_type]
+        self.names = frozenset(self.dispatch)
+
+    def parse(self, query_params):
+        """Return parsed params for a parse_qs style dict of lists.
+
+        Raises ParameterKeyError for unknown arguments, before any value is
+        parsed, and ParameterValueError for malformed values.
+        """
+        invalid = [name for name in query_params if name not in self.names]
+        if invalid:
+            raise exceptions.ParameterKeyError(key=", ".join(invalid))
+
+        parsed = dict(self.defaults)
+        dispatch = self.dispatch
+        for name, values in query_params.iteritems():
+            parser, key = dispatch[name]
+            if parser is None:
+                continue
+            value = parser(name, values)
+            if value is not None:
+                parsed[key] = value
+
+        return parsed
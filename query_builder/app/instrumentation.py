@@ -0,0 +1,164 @@
+"""Optional hot path instrumentation.
+
+Functions decorated with instrumented record latency histograms and error
+counts by exception type into the process wide stats object while it is
+enabled. When disabled the only overhead is a single attribute check.
+
+    stats.enabled = True
+    ...
+    stats.snapshot()    # dict of histograms and counters
+    stats.prometheus()  # Prometheus text exposition format
+
+The stats are per process: under the pre-forked server each worker keeps its
+own, and a scrape sees the worker which answered it. Every sample is
+labelled with the process id so they can be summed across workers, e.g.
+sum without (pid) (...).
+"""
+
+import bisect
+import functools
+import os
+import threading
+import timeit
+
+from query_builder.config import settings
+
+clock = timeit.default_timer
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+METRIC_PREFIX = "query_builder"
+
+
+class Histogram(object):
+    """Cumulative-free bucketed histogram of observed values."""
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        return {
+            "buckets": dict(zip(self.bounds + ("+Inf",), self.counts)),
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+
+class Stats(object):
+    """In-process store of latency histograms and counters."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.latencies = {}
+            self.errors = {}
+            self.filter_usage = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.latencies.get(stage)
+            if histogram is None:
+                histogram = self.latencies[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def count_error(self, stage, exception):
+        key = (stage, type(exception).__name__)
+        with self._lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def count_filters(self, params):
+        """Count the filters used by a parsed params dict."""
+        with self._lock:
+            for key, value in params.iteritems():
+                if value is not None and key not in ("size", "from"):
+                    self.filter_usage[key] = self.filter_usage.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "latency_seconds": dict(
+                    (stage, histogram.snapshot())
+                    for stage, histogram in self.latencies.iteritems()),
+                "errors": dict(("{}:{}".format(*key), count)
+                               for key, count in self.errors.iteritems()),
+                "filter_usage": dict(self.filter_usage),
+            }
+
+    def prometheus(self):
+        """Render the stats in the Prometheus text exposition format.
+
+        Every sample carries a pid label, as the stats are per process.
+        """
+        lines = []
+        pid = 'pid="{}"'.format(os.getpid())
+        with self._lock:
+            name = "{}_latency_seconds".format(METRIC_PREFIX)
+            lines.append("# TYPE {} histogram".format(name))
+            for stage in sorted(self.latencies):
+                histogram = self.latencies[stage]
+                cumulative = 0
+                for bound, count in zip(histogram.bounds + ("+Inf",),
+                                        histogram.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{{{},stage="{}",le="{}"}} {}'.format(
+                        name, pid, stage, bound, cumulative))
+                lines.append('{}_sum{{{},stage="{}"}} {!r}'.format(
+                    name, pid, stage, histogram.sum))
+                lines.append('{}_count{{{},stage="{}"}} {}'.format(
+                    name, pid, stage, histogram.count))
+
+            name = "{}_errors_total".format(METRIC_PREFIX)
+            lines.append("# TYPE {} counter".format(name))
+            for (stage, exception), count in sorted(self.errors.iteritems()):
+                lines.append('{}{{{},stage="{}",exception="{}"}} {}'.format(
+                    name, pid, stage, exception, count))
+
+            name = "{}_filter_usage_total".format(METRIC_PREFIX)
+            lines.append("# TYPE {} counter".format(name))
+            for key, count in sorted(self.filter_usage.iteritems()):
+                lines.append('{}{{{},filter="{}"}} {}'.format(
+                    name, pid, key, count))
+        return "\n".join(lines) + "\n"
+
+
+stats = Stats(enabled=settings.app_settings["instrumentation_enabled"])
+
+
+def instrumented(stage):
+    """Decorate a function to record its latency and errors under stage."""
+
+    def decorator(method):
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if not stats.enabled:
+                return method(*args, **kwargs)
+
+            started = clock()
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                stats.count_error(stage, e)
+                raise
+            finally:
+                stats.observe(stage, clock() - started)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,92 @@
+"""Parallel translation of large URL corpora across a process pool.
+
+Query building is pure Python CPU work, so threads do not help; instead
+URLs are sent in chunks to worker processes, each with its own long-lived
+builder (and query cache). At most a few chunks per worker are in flight
+at a time, so arbitrarily long URL streams are translated in bounded
+memory.
+"""
+
+import collections
+import itertools
+import multiprocessing
+
+from query_builder.app.elastic import piston
+from query_builder.app.handlers.batch import BatchQueryBuilder, BatchResult
+
+_worker_builder = None
+
+
+def _init_worker():
+    global _worker_builder
+    # Background threads of the parent, e.g. the async log writer, do not
+    # survive the fork, so the worker starts its own
+    piston.reset_process_state()
+    _worker_builder = BatchQueryBuilder()
+
+
+def _translate_chunk(urls, as_json):
+    return [tuple(result)
+            for result in _worker_builder.build_many(urls, as_json=as_json)]
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def translate_parallel(urls, processes=None, chunk_size=200, ordered=True,
+                       as_json=True, chunks_per_process=4):
+    """Translate URLs on a pool of worker processes.
+
+    Args:
+        urls: iterable of request URL paths
+        processes: number of workers, defaults to one per CPU
+        chunk_size: URLs sent to a worker at a time
+        ordered: yield results in input order, otherwise as completed
+        as_json: return queries as compact JSON, cheaper to send back from
+            the workers than dicts
+        chunks_per_process: chunks queued per worker before waiting
+
+    Returns:
+        Generator of BatchResult, with per URL errors reported on the result
+    """
+    processes = processes or multiprocessing.cpu_count()
+    max_in_flight = processes * chunks_per_process
+    pool = multiprocessing.Pool(processes, initializer=_init_worker)
+    in_flight = collections.deque()
+
+    def completed(block):
+        if ordered:
+            if in_flight and (block or in_flight[0].ready()):
+                return [in_flight.popleft()]
+            return []
+        while True:
+            ready = [result for result in in_flight if result.ready()]
+            if ready or not block or not in_flight:
+                for result in ready:
+                    in_flight.remove(result)
+                return ready
+            in_flight[0].wait(0.005)
+
+    try:
+        for chunk in _chunks(urls, chunk_size):
+            in_flight.append(pool.apply_async(_translate_chunk,
+                                              (chunk, as_json)))
+            block = len(in_flight) >= max_in_flight
+            for result in completed(block):
+                for item in result.get():
+                    yield BatchResult(*item)
+
+        while in_flight:
+            for result in completed(True):
+                for item in result.get():
+                    yield BatchResult(*item)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,147 @@
+"""Sector taxonomy index.
+
+Sectors form a forest: selecting a sector selects every sector below it. The
+taxonomy is laid out in preorder, so the descendants of a sector occupy a
+contiguous slice of one array ending at its precomputed subtree end. Validity,
+descendants and subtree size are then an index lookup and a slice, with no
+walk of the tree per request.
+"""
+
+import array
+
+from query_builder.config import settings
+
+
+class SectorTaxonomy(object):
+    """Preorder index of a sector hierarchy.
+
+    Args:
+        pairs: iterable of (sector id, parent id) string pairs, the parent
+            id being None or empty for top level sectors
+    """
+
+    def __init__(self, pairs):
+        parent_of = {}
+        for sector, parent in pairs:
+            if sector in parent_of:
+                raise ValueError("Duplicate sector id: {}".format(sector))
+            parent_of[sector] = parent or None
+
+        children = {}
+        for sector, parent in parent_of.iteritems():
+            if parent is not None and parent not in parent_of:
+                raise ValueError("Unknown parent {} of sector {}".format(
+                    parent, sector))
+            children.setdefault(parent, []).append(sector)
+        for siblings in children.itervalues():
+            siblings.sort()
+
+        # Iterative preorder walk, filling in subtree ends on the way back up
+        self.order = []
+        self.positions = {}
+        self.parents = array.array("l")
+        self.ends = array.array("l")
+        stack = [(sector, -1, False) for sector in
+                 reversed(children.get(None, []))]
+        while stack:
+            sector, parent, done = stack.pop()
+            if done:
+                self.ends[self.positions[sector]] = len(self.order) - 1
+                continue
+            position = len(self.order)
+            self.positions[sector] = position
+            self.order.append(sector)
+            self.parents.append(parent)
+            self.ends.append(position)
+            stack.append((sector, parent, True))
+            stack.extend((child, position, False) for child in
+                         reversed(children.get(sector, [])))
+        self.order = tuple(self.order)
+
+        if len(self.order) != len(parent_of):
+            raise ValueError("Sector taxonomy contains a cycle")
+
+    @classmethod
+    def load(cls, path):
+        """Load a taxonomy from a file of "sector_id,parent_id" lines.
+
+        Blank lines and lines starting with # are ignored.
+        """
+        pairs = []
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                sector, _, parent = line.partition(",")
+                pairs.append((sector.strip(), parent.strip()))
+        return cls(pairs)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, sector):
+        return sector in self.positions
+
+    def subtree_size(self, sector):
+        """Number of sectors in the subtree of sector, including itself."""
+        position = self.positions[sector]
+        return self.ends[position] - position + 1
+
+    def descendants(self, sector):
+        """sector and every sector below it, in preorder."""
+        position = self.positions[sector]
+        return self.order[position:self.ends[position] + 1]
+
+    def path(self, sector):
+        """Ids from the top level sector down to sector, joined by "/"."""
+        position = self.positions[sector]
+        path = []
+        while position != -1:
+            path.append(self.order[position])
+            position = self.parents[position]
+        return "/".join(reversed(path))
+
+    def subtree_roots(self, sectors):
+        """Smallest set of sectors whose subtrees cover sectors' subtrees.
+
+        Duplicates and sectors below another selected sector are dropped.
+        Returned in preorder. Raises KeyError for an unknown sector.
+        """
+        positions = sorted(set(self.positions[sector] for sector in sectors))
+        roots = []
+        covered_to = -1
+        for position in positions:
+            if position > covered_to:
+                roots.append(self.order[position])
+                covered_to = self.ends[position]
+        return roots
+
+
+_taxonomy = None
+_taxonomy_path = None
+
+
+def load_sector_taxonomy():
+    """Load and validate the configured taxonomy, returning it or None.
+
+    Call at start-up, before forking any workers, so a missing or invalid
+    taxonomy fails the boot with IOError / ValueError rather than failing
+    requests, and forked workers share the parent's copy.
+    """
+    return get_sector_taxonomy()
+
+
+def get_sector_taxonomy():
+    """Return the taxonomy at settings.SECTOR_TAXONOMY_PATH, or None if no
+    taxonomy is configured. Loaded once per process and path, on first use
+    if load_sector_taxonomy was not called at start-up.
+    """
+    global _taxonomy, _taxonomy_path
+    path = settings.SECTOR_TAXONOMY_PATH
+    if path is None:
+        return None
+    if _taxonomy is None or _taxonomy_path != path:
+        _taxonomy = SectorTaxonomy.load(path)
+        _taxonomy_path = path
+    return _taxonomy
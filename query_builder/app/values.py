@@ -0,0 +1,39 @@
+"""Compact value objects for parsed request parameters.
+
+Each is an immutable, __slots__-only tuple subclass, so it is cheap to
+create, cheap to read and hashable, letting parsed params double as cache
+keys.
+"""
+
+import collections
+
+
+class Range(collections.namedtuple("Range", ["gte", "lte"])):
+    """Numerical range, either bound may be None."""
+    __slots__ = ()
+
+
+class DateRange(collections.namedtuple("DateRange", ["gte", "lte"])):
+    """Range of ISO formatted dates, either bound may be None."""
+    __slots__ = ()
+
+
+class IdSet(tuple):
+    """Sorted, duplicate free ids."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "IdSet({})".format(tuple.__repr__(self))
+
+
+class PageWindow(collections.namedtuple(
+        "PageWindow", ["size", "offset", "cursor", "search_after"])):
+    """Page of results requested.
+
+    With cursor pagination offset is None and search_after holds the sort
+    values to continue after, or None for the first page.
+    """
+    __slots__ = ()
+
+
+VALUE_TYPES = (Range, DateRange, IdSet, PageWindow)
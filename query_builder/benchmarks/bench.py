@@ -0,0 +1,230 @@
+"""
+
+Usage:
+    bench.py [--count=<n>] [--seed=<seed>] [--output=<file>]
+             [--compare=<baseline>] [--threshold=<fraction>]
+
+Options:
+    --count=<n>             - Number of URLs in the corpus [default: 5000].
+    --seed=<seed>           - Corpus random seed [default: 0].
+    --output=<file>         - Write the results as JSON to this file.
+    --compare=<baseline>    - JSON results of a previous run to compare with.
+    --threshold=<fraction>  - Slowdown flagged as a regression [default: 0.1].
+
+Times each stage of turning a URL into a logged ES query over a seeded URL
+corpus, reporting requests/sec and p50/p99 latency per stage, along with the
+objects each stage allocates and its peak memory growth.
+"""
+import gc
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import timeit
+import urlparse
+
+import docopt
+
+from query_builder.app.elastic import companies_search
+from query_builder.app.elastic.piston import Piston
+from query_builder.app.handlers.company_query_builder import COMPANY_PARAMETERS
+from query_builder.app.handlers.pagination import Pagination
+from query_builder.benchmarks.corpus import generate_corpus
+
+clock = timeit.default_timer
+
+STAGES = ["parse_url", "parse_parameters", "query_builder", "serialize",
+          "log_query"]
+
+
+def _parse_url(url):
+    return urlparse.parse_qs(urlparse.urlparse(url).query)
+
+
+def _parse_parameters(query_params):
+    pagination = Pagination(limit=query_params.get("limit", [None])[-1],
+                            offset=query_params.get("offset", [0])[-1],
+                            cursor=query_params.get("cursor", [None])[-1])
+    params = COMPANY_PARAMETERS.parse(query_params)
+    return pagination.add_to_params(params)
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def _summarise(timings):
+    if not timings:
+        return {"requests_per_sec": None, "p50_us": None, "p99_us": None}
+    timings = sorted(timings)
+    total = sum(timings)
+    return {
+        "requests_per_sec": len(timings) / total if total else None,
+        "p50_us": _percentile(timings, 0.5) * 1e6,
+        "p99_us": _percentile(timings, 0.99) * 1e6,
+    }
+
+
+def _bench_logger(log_path):
+    logger = logging.getLogger("query_builder.benchmarks.queries")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    handler = logging.FileHandler(log_path)
+    handler.setFormatter(logging.Formatter(
+        "%(asctime)s - %(levelname)s - %(message)s"))
+    logger.handlers = [handler]
+    return logger
+
+
+def _measure_allocations(stage, inputs):
+    """Memory used by a stage over inputs.
+
+    Returns (objects, rss_kb): the mean number of garbage collector tracked
+    objects (dicts, lists...) per call still reachable from the stage's
+    output, and the growth in peak resident set size, in KB on Linux, while
+    running it. Both are None without inputs.
+    """
+    if not inputs:
+        return None, None
+    outputs = []
+    gc.collect()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    objects_before = len(gc.get_objects())
+    for item in inputs:
+        outputs.append(stage(item))
+    # less the outputs list itself
+    objects = len(gc.get_objects()) - objects_before - 1
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    # freed caches can make the count dip below zero
+    return max(objects, 0) / float(len(inputs)), rss
+
+
+def run(urls, log_path):
+    """Run every URL through each stage in turn.
+
+    Returns a dict of stage name to summary statistics, plus "total".
+    """
+    # Always measure the synchronous log write
+    piston = Piston()
+    piston.log_writer = None
+    piston.queries_log = _bench_logger(log_path)
+
+    stages = [
+        ("parse_url", _parse_url),
+        ("parse_parameters", _parse_parameters),
+        ("query_builder", companies_search.query_builder),
+        ("serialize", companies_search.dumps),
+        ("log_query", piston._log_query),
+    ]
+
+    timings = dict((name, []) for name, _ in stages)
+    totals = []
+    inputs = dict((name, []) for name, _ in stages)
+    errors = 0
+    for url in urls:
+        value = url
+        url_inputs = []
+        url_timings = []
+        started = clock()
+        try:
+            for name, stage in stages:
+                url_inputs.append(value)
+                stage_started = clock()
+                value = stage(value)
+                url_timings.append(clock() - stage_started)
+        except Exception:
+            # Only URLs making it through every stage are measured, so the
+            # stages are compared over the same inputs
+            errors += 1
+            continue
+        totals.append(clock() - started)
+        for (name, _), stage_input, timing in zip(stages, url_inputs,
+                                                  url_timings):
+            inputs[name].append(stage_input)
+            timings[name].append(timing)
+
+    results = {}
+    for name, stage in stages:
+        results[name] = _summarise(timings[name])
+        objects, rss = _measure_allocations(stage, inputs[name][:1000])
+        results[name]["allocated_objects"] = objects
+        results[name]["max_rss_growth_kb"] = rss
+    results["total"] = _summarise(totals)
+    results["total"]["errors"] = errors
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return a list of (stage, metric, baseline, current) regressions.
+
+    A regression is a drop in requests/sec or a rise in p50/p99 latency
+    larger than threshold, as a fraction of the baseline.
+    """
+    regressions = []
+    for stage in STAGES + ["total"]:
+        current, previous = results.get(stage), baseline.get(stage)
+        if not current or not previous:
+            continue
+        for metric, limit in (("requests_per_sec", -threshold),
+                              ("p50_us", threshold), ("p99_us", threshold)):
+            now, before = current.get(metric), previous.get(metric)
+            # Stages without any successful calls have no statistics
+            if now is None or before is None:
+                continue
+            if (now - before) * (1 if limit > 0 else -1) > \
+                    before * abs(limit):
+                regressions.append((stage, metric, before, now))
+    return regressions
+
+
+def _format_value(value, width, precision):
+    if value is None:
+        return "{:>{}}".format("n/a", width)
+    return "{:>{}.{}f}".format(value, width, precision)
+
+
+def _format_results(results):
+    lines = ["{:<18}{:>14}{:>12}{:>12}{:>14}{:>12}".format(
+        "stage", "req/s", "p50 us", "p99 us", "alloc objs", "rss kb")]
+    for stage in STAGES + ["total"]:
+        r = results[stage]
+        lines.append("{:<18}{}{}{}{}{}".format(
+            stage, _format_value(r["requests_per_sec"], 14, 0),
+            _format_value(r["p50_us"], 12, 1),
+            _format_value(r["p99_us"], 12, 1),
+            _format_value(r.get("allocated_objects"), 14, 1),
+            _format_value(r.get("max_rss_growth_kb"), 12, 0)))
+    return "\n".join(lines)
+
+
+def main(args):
+    urls = generate_corpus(int(args["--count"]), int(args["--seed"]))
+    log_fd, log_path = tempfile.mkstemp(suffix=".log")
+    os.close(log_fd)
+    try:
+        results = run(urls, log_path)
+    finally:
+        os.remove(log_path)
+
+    print _format_results(results)
+    if args["--output"]:
+        with open(args["--output"], "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args["--compare"]:
+        with open(args["--compare"]) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, float(args["--threshold"]))
+        for stage, metric, previous, current in regressions:
+            print "REGRESSION {} {}: {:.1f} -> {:.1f}".format(
+                stage, metric, previous, current)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(docopt.docopt(__doc__)))
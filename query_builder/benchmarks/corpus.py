@@ -0,0 +1,68 @@
+"""Seeded generator of realistic company query builder URLs."""
+
+import datetime
+import random
+import urllib
+
+BASE_PATH = "/v1/company_query_builder"
+
+
+def _range(rng, low, high):
+    lower = rng.choice([None, rng.randint(low, high)])
+    upper = rng.choice([None, rng.randint(low, high)])
+    if lower is None and upper is None:
+        upper = high
+    if lower is not None and upper is not None and lower > upper:
+        lower, upper = upper, lower
+    return "{}-{}".format("" if lower is None else lower,
+                          "" if upper is None else upper)
+
+
+def _date_range(rng):
+    start = datetime.date(2010, 1, 1) + datetime.timedelta(
+        days=rng.randint(0, 2500))
+    end = start + datetime.timedelta(days=rng.choice([30, 90, 365, 730]))
+    lower = rng.choice([start.strftime("%Y%m%d")] * 3 + [""])
+    upper = rng.choice([end.strftime("%Y%m%d")] * 3 + [""])
+    return "{}-{}".format(lower, upper)
+
+
+def _cids(rng):
+    # Mostly short lists, occasionally a watchlist of hundreds of companies
+    count = rng.choice([1, 2, 5, 10, 20]) if rng.random() < 0.9 \
+        else rng.randint(100, 800)
+    return [str(rng.randint(1, 10000000)) for _ in range(count)]
+
+
+def generate_url(rng):
+    """Return a single URL drawn from a realistic mix of parameters."""
+    params = []
+    if rng.random() < 0.6:
+        params.append(("revenue", _range(rng, 0, 100000000)))
+    if rng.random() < 0.3:
+        params.append(("cash", _range(rng, -1000000, 10000000)))
+    if rng.random() < 0.4:
+        params.extend(("sector_context", str(rng.randint(1, 300)))
+                      for _ in range(rng.randint(1, 5)))
+    if rng.random() < 0.3:
+        params.extend(("cid", cid) for cid in _cids(rng))
+    if rng.random() < 0.35:
+        params.append(("trading_activity", _date_range(rng)))
+    for flag in ("ecommerce", "exclude_tps", "aggregate"):
+        if rng.random() < 0.2:
+            params.append((flag, rng.choice(["true", "false", "1", "0"])))
+    if rng.random() < 0.5:
+        params.append(("limit", str(rng.choice([10, 20, 50, 100, 500]))))
+    if rng.random() < 0.5:
+        params.append(("offset", str(rng.choice([0, 50, 100, 450]))))
+
+    rng.shuffle(params)
+    if not params:
+        return BASE_PATH
+    return "{}?{}".format(BASE_PATH, urllib.urlencode(params))
+
+
+def generate_corpus(count, seed=0):
+    """Return a list of count URLs, identical for a given seed."""
+    rng = random.Random(seed)
+    return [generate_url(rng) for _ in range(count)]
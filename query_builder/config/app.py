@@ -4,24 +4,202 @@ class AppSettings(object):
         self.app_settings = dict()
         self.SECTOR_ES_FIELD = 'sector.id'
 
-        self.COMPANIES_FILTERS = [
-            "revenue",
-            "sector_context",
-            "ecommerce",
-            "limit",
-            "offset",
+        # Sector hierarchy, a file of "sector_id,parent_id" lines, None for
+        # flat sectors. With a taxonomy sector_context ids are validated and
+        # select every sector below them.
+        self.SECTOR_TAXONOMY_PATH = None
+        # Field holding the "/" joined ids from the top level sector down to
+        # the company's sector, indexed with a path_hierarchy tokenizer so a
+        # term on a sector's path matches its whole subtree
+        self.SECTOR_PATH_ES_FIELD = 'sector.path'
+
+        # Cluster searched by Piston.company_search_results
+        self.ES_URL = "http://localhost:9200"
+        self.ES_COMPANIES_INDEX = "companies"
+        self.ES_COMPANIES_DOC_TYPE = "company"
+
+        # Parent level summaries of each trading activity child document
+        # type, used by the "denormalized" trading_activity_mode: the first
+        # and last event dates and the "YYYY-MM" months with any event
+        self.TRADING_ACTIVITY_DENORMALIZED_FIELDS = {
+            "import_events": {
+                "first": "first_import_date",
+                "last": "last_import_date",
+                "months": "import_months",
+            },
+            "export_events": {
+                "first": "first_export_date",
+                "last": "last_export_date",
+                "months": "export_months",
+            },
+        }
+
+        # Stable sort of cursor paginated searches, ending with a unique
+        # tiebreaker so every hit has distinct sort values
+        self.CURSOR_SORT = [
+            {"_score": "desc"},
+            {"cid": "asc"},
+        ]
+
+        # Company document fields which may be requested with the fields and
+        # exclude_fields parameters, along with their sub-fields
+        self.COMPANIES_SOURCE_FIELDS = [
             "cid",
-            "exclude_tps",
-            "cash",
-            "aggregate",
-            "trading_activity",
+            "name",
+            "status",
+            "sector",
+            "address",
+            "website",
+            "ecommerce",
+            "tps",
+            "financial_filters",
+        ]
+
+        # Aggregations returned by aggregate=true queries, by name. Requests
+        # may pick a subset with &aggregation=<name>, which is only accepted
+        # along with aggregate=true
+        self.COMPANIES_AGGREGATIONS = {
+            "sectors": {
+                "terms": {
+                    "field": self.SECTOR_ES_FIELD,
+                    "size": 50
+                }
+            },
+            "revenue": {
+                "nested": {
+                    "path": "financial_filters"
+                },
+                "aggs": {
+                    "revenue": {
+                        "histogram": {
+                            "field": "financial_filters.revenue",
+                            "interval": 1000000
+                        }
+                    }
+                }
+            },
+        }
+
+        # Query DSL dialect: "legacy" for Elasticsearch 1.x filtered queries,
+        # "bool" for 5.x+ / OpenSearch bool.filter queries
+        self.ES_DIALECT = "legacy"
+
+        # Company query builder URL parameters, one entry per parameter:
+        # (url argument, type, parsed_params key or None to use the argument)
+        # Types: range e.g. 1000-5000, date_range e.g. 20150101-20160101,
+        # multi_value for repeatable arguments, id_list for repeatable integer
+        # ids, sector_ids for SECTOR_TAXONOMY_PATH sectors, source_fields for
+        # COMPANIES_SOURCE_FIELDS names, aggregations for
+        # COMPANIES_AGGREGATIONS names, string,
+        # boolean, flag (a boolean only included when true) and pagination
+        # (handled by Pagination).
+        self.COMPANIES_PARAMETERS = [
+            ("revenue", "range", None),
+            ("cash", "range", None),
+            ("sector_context", "sector_ids", "sectors"),
+            ("cid", "id_list", "cids"),
+            ("cid_list", "string", None),
+            ("ecommerce", "flag", None),
+            ("exclude_tps", "flag", None),
+            ("aggregate", "boolean", None),
+            ("aggregation", "aggregations", "aggregations"),
+            ("count_only", "flag", None),
+            ("fields", "source_fields", "source_includes"),
+            ("exclude_fields", "source_fields", "source_excludes"),
+            ("trading_activity", "date_range", None),
+            ("limit", "pagination", None),
+            ("offset", "pagination", None),
+            ("cursor", "pagination", None),
         ]
+        self.COMPANIES_FILTERS = [name for name, _, _
+                                  in self.COMPANIES_PARAMETERS]
+
+        # Stored id list documents referenced by the cid_list parameter,
+        # used as a terms lookup so the cluster fetches the ids itself
+        self.CID_LIST_LOOKUP = {
+            "index": "cid_lists",
+            "type": "cid_list",
+            "path": "cids",
+        }
+
+        # Fields holding at most one value per company. The optimizer may
+        # intersect terms filters on these, which would change the results
+        # for multi valued fields such as sector.id
+        self.SINGLE_VALUED_FIELDS = frozenset(["cid"])
+
+        # Relative cost of executing each filter type, used to order the
+        # filters in a query cheap first
+        self.FILTER_COSTS = {
+            "term": 1,
+            "terms": 2,
+            "missing": 2,
+            "exists": 2,
+            "range": 3,
+            "nested": 5,
+            "has_child": 10,
+            "has_parent": 10,
+            "default": 4,
+        }
 
         self.app_settings["version"] = "2.19"
 
         # High level constants
         self.app_settings["results_limit_default"] = 500
         self.app_settings["page_size_default"] = 50
+        self.app_settings["cursor_page_size_max"] = 1000
+
+        # Query log: "sync" writes on the request path, "async" hands records
+        # to a background writer thread.
+        self.app_settings["query_log_mode"] = "sync"
+        self.app_settings["query_log_queue_size"] = 10000
+        self.app_settings["query_log_batch_size"] = 500
+        self.app_settings["query_log_flush_interval"] = 0.2
+        self.app_settings["query_log_sample_rate"] = 1.0
+        self.app_settings["query_log_overload_policy"] = "drop"
+
+        # Number of built queries kept in the LRU cache, 0 disables it. The
+        # cache is keyed on the settings above that shape queries; after
+        # changing any of the structured ones (FILTER_COSTS, CID_LIST_LOOKUP,
+        # COMPANIES_AGGREGATIONS...) call piston.clear_query_cache()
+        self.app_settings["query_cache_size"] = 1024
+
+        # Snap trading_activity dates outwards to "month", "quarter" or
+        # "year" boundaries (None for exact dates), so similar requests share
+        # cluster filter cache entries. With the post filter enabled the
+        # exact dates are still applied, as a post_filter. Elasticsearch
+        # computes aggregations before post_filter, so aggregate=true counts
+        # then cover the rounded dates and may exceed the exact hits total.
+        self.app_settings["trading_activity_rounding"] = None
+        self.app_settings["trading_activity_exact_post_filter"] = False
+
+        # "has_child" filters trading_activity on the event child documents.
+        # "denormalized" uses TRADING_ACTIVITY_DENORMALIZED_FIELDS where they
+        # answer the date range exactly (open ended ranges, and ranges of
+        # whole months), and has_child otherwise. Rounded ranges are whole
+        # months, but the exact dates of trading_activity_exact_post_filter
+        # rarely are, so that post_filter nearly always still uses has_child:
+        # leave it disabled to avoid the join entirely.
+        self.app_settings["trading_activity_mode"] = "has_child"
+
+        # ES executor: connection pool size, socket timeout in seconds,
+        # retries per request and the window in seconds in which concurrent
+        # searches are batched into one _msearch request
+        self.app_settings["es_pool_size"] = 10
+        self.app_settings["es_timeout"] = 5.0
+        self.app_settings["es_retries"] = 2
+        self.app_settings["es_batch_window"] = 0.002
+        self.app_settings["es_max_batch_size"] = 100
+
+        # Subtrees of at least this many selected sectors are matched with a
+        # single term on SECTOR_PATH_ES_FIELD instead of a term per sector,
+        # None to always list the sector ids
+        self.app_settings["sector_path_min_subtree"] = None
+
+        # Run the optimizer pass over the filters of every query
+        self.app_settings["optimize_filters"] = True
+
+        # Record latency histograms and error counts, see app.instrumentation
+        self.app_settings["instrumentation_enabled"] = False
 
     
 settings = AppSettings()
@@ -1,28 +1,64 @@
 """Module for defining API Exceptions."""
 
 
+def to_text(value):
+    """Return value as unicode text, replacing bytes that are not UTF-8.
+
+    Request URLs can carry any bytes, so keys and values quoted in error
+    messages are decoded leniently rather than failing on formatting or
+    JSON encoding.
+    """
+    if isinstance(value, unicode):
+        return value
+    if not isinstance(value, str):
+        try:
+            return unicode(value)
+        except UnicodeError:
+            value = str(value)
+    return value.decode("utf-8", "replace")
+
+
 class ClientError(Exception):
     def __init__(self, msg):
+        msg = to_text(msg)
         super(ClientError, self).__init__(msg)
         self.message = self.msg = msg
 
+    def __str__(self):
+        return self.msg.encode("utf-8")
+
+    def __unicode__(self):
+        return self.msg
+
 
 class ESQueryError(Exception):
     """Exception related to building the ES query structure."""
 
     def __init__(self, err, method):
         self.msg = "Query build error"
-        self.details = "{}: {}".format(method, err)
+        self.details = u"{}: {}".format(to_text(method), to_text(err))
 
 
 class ParameterKeyError(ClientError):
     def __init__(self, key):
-        super(ParameterKeyError, self).__init__("Key Error: {}".format(key))
+        super(ParameterKeyError, self).__init__(
+            u"Key Error: {}".format(to_text(key)))
 
 
 class ParameterValueError(ClientError):
     def __init__(self, key, value, message=''):
         if message:
-            message = ' - ' + message
+            message = u' - ' + to_text(message)
         super(ParameterValueError, self).__init__(
-            u"Value Error for key '{}': {}{}".format(key, value, message))
+            u"Value Error for key '{}': {}{}".format(
+                to_text(key), to_text(value), message))
+
+
+class ESSearchError(Exception):
+    """Exception related to executing a query against Elasticsearch."""
+
+    def __init__(self, details, status=None):
+        super(ESSearchError, self).__init__(details)
+        self.msg = "Search error"
+        self.details = details
+        self.status = status
@@ -1,18 +1,38 @@
 """
 
 Usage:
-    main.py <url_path>
+    main.py [--compact] <url_path>
+    main.py --batch [--workers=<n>] [<file>]
 
 Options:
     <url_path> - URL path with query parameters to turn into query.
                  e.g. /v1/company_query_builder?revenue=20150101-20160101
-                 
+    --compact  - Print the query as compact JSON.
+    --batch    - Read URL paths line by line from <file>, or stdin, and
+                 write one compact JSON query per line to stdout. URLs which
+                 can not be translated produce {"url": ..., "error": ...}.
+    --workers=<n> - Translate batches on n worker processes [default: 1].
+
 """
 import json
+import sys
 
 import docopt
 
+from query_builder import exceptions
 from query_builder.app import handlers
+from query_builder.app.parallel import translate_parallel
+from query_builder.app.taxonomy import load_sector_taxonomy
+
+_batch_builder = None
+
+
+def _get_batch_builder():
+    """Return the process wide builder, creating it on first use."""
+    global _batch_builder
+    if _batch_builder is None:
+        _batch_builder = handlers.BatchQueryBuilder()
+    return _batch_builder
 
 
 def get_es_query(request_url):
@@ -24,11 +44,80 @@ def get_es_query(request_url):
     Returns:
         Dictionary - elasticsearch query
     """
-    handler = handlers.CompanyQueryBuilder(request_url)
-    return handler.get()
+    return _get_batch_builder().build(request_url)
+
+
+def get_es_query_json(request_url):
+    """
+    Given a request URL path with query parameters, return an elasticsearch
+    query serialised as compact JSON
+    Args:
+        request_url: path with query parameters, string
+
+    Returns:
+        String - UTF-8 encoded elasticsearch query
+    """
+    return _get_batch_builder().build(request_url, as_json=True)
+
+
+def get_es_queries(request_urls, as_json=False):
+    """
+    Given an iterable of request URL paths, yield a result for each one
+    Args:
+        request_urls: iterable of paths with query parameters
+        as_json: return the queries serialised as compact JSON
+
+    Returns:
+        Generator of handlers.BatchResult - the elasticsearch query, or the
+        error message if the URL could not be translated
+    """
+    return _get_batch_builder().build_many(request_urls, as_json=as_json)
+
+
+def translate_lines(lines, workers=1):
+    """
+    Translate request URL paths, one per line, into NDJSON lines
+    Args:
+        lines: iterable of lines, blank lines are skipped
+        workers: number of processes to translate on
+
+    Returns:
+        Generator of strings - a compact JSON query, or error record, per URL
+    """
+    urls = (line.strip() for line in lines)
+    urls = (url for url in urls if url)
+    if workers > 1:
+        results = translate_parallel(urls, processes=workers)
+    else:
+        results = get_es_queries(urls, as_json=True)
+    for result in results:
+        if result.ok:
+            yield result.query
+        else:
+            yield json.dumps({"url": exceptions.to_text(result.url),
+                              "error": exceptions.to_text(result.error)},
+                             separators=(",", ":"))
+
+
+def translate_stream(in_file, out_file, workers=1):
+    """Stream NDJSON queries for the URLs in in_file to out_file."""
+    for line in translate_lines(in_file, workers):
+        out_file.write(line)
+        out_file.write("\n")
 
 
 if __name__ == "__main__":
     args = docopt.docopt(__doc__)
-    es_query = get_es_query(args['<url_path>'])
-    print json.dumps(es_query, indent=2)
+    load_sector_taxonomy()
+    if args['--batch']:
+        workers = int(args['--workers'])
+        if args['<file>']:
+            with open(args['<file>']) as in_file:
+                translate_stream(in_file, sys.stdout, workers)
+        else:
+            translate_stream(sys.stdin, sys.stdout, workers)
+    elif args['--compact']:
+        print get_es_query_json(args['<url_path>'])
+    else:
+        es_query = get_es_query(args['<url_path>'])
+        print json.dumps(es_query, indent=2)
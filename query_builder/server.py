@@ -0,0 +1,225 @@
+"""
+
+Usage:
+    server.py [--host=<host>] [--port=<port>] [--workers=<n>]
+
+Options:
+    --host=<host>  - Interface to listen on [default: 127.0.0.1].
+    --port=<port>  - Port to listen on [default: 8080].
+    --workers=<n>  - Number of worker processes, defaults to one per CPU.
+
+Long running HTTP front end for the query builder. Serves
+GET /v1/company_query_builder?<params> with the ES query as JSON, and
+GET /metrics with the instrumentation stats in Prometheus text format. The
+stats are kept per worker process and labelled with its pid: each scrape
+reports the worker which answered it.
+Parameters too long for a URL, such as large cid lists, can be POSTed to
+/v1/company_query_builder as a form or JSON body.
+"""
+import BaseHTTPServer
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import SocketServer
+import urlparse
+
+import docopt
+
+from query_builder import exceptions
+from query_builder.app import handlers
+from query_builder.app.coalescing import Coalescer
+from query_builder.app.instrumentation import stats
+from query_builder.app.taxonomy import load_sector_taxonomy
+
+COMPANY_QUERY_BUILDER_PATH = "/v1/company_query_builder"
+METRICS_PATH = "/metrics"
+
+JSON_CONTENT_TYPE = "application/json"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+log = logging.getLogger("query_builder.server")
+
+_batch_builder = None
+
+# Identical requests in flight at the same time share one query build
+coalescer = Coalescer()
+
+
+def _get_batch_builder():
+    """Return the worker's builder, created lazily so it is never forked."""
+    global _batch_builder
+    if _batch_builder is None:
+        _batch_builder = handlers.BatchQueryBuilder()
+    return _batch_builder
+
+
+def _error(status, message, details=None):
+    # Messages can quote request bytes that are not UTF-8
+    body = {"error": exceptions.to_text(message)}
+    if details:
+        body["details"] = exceptions.to_text(details)
+    return status, JSON_CONTENT_TYPE, json.dumps(body)
+
+
+def parse_body(body, content_type):
+    """Parse a request body into a {name: [values]} dict.
+
+    JSON objects and form encoded bodies are supported.
+    """
+    if not body:
+        return None
+    if (content_type or "").split(";")[0].strip() == "application/json":
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise exceptions.ClientError("Malformed JSON body")
+        if not isinstance(data, dict):
+            raise exceptions.ClientError("JSON body must be an object")
+        return dict(
+            (name, [unicode(v) for v in value]
+             if isinstance(value, list) else [unicode(value)])
+            for name, value in data.iteritems())
+    return urlparse.parse_qs(body)
+
+
+def _build(url, body, content_type):
+    body_params = parse_body(body, content_type)
+    return _get_batch_builder().build(url, as_json=True,
+                                      body_params=body_params)
+
+
+def dispatch(method, url, body=None, content_type=None):
+    """Route a request to its handler.
+
+    Args:
+        method: HTTP method
+        url: request path with query string
+        body: POST request body
+        content_type: Content-Type of the body
+
+    Returns:
+        (status code, content type, response body)
+    """
+    path = url.split("?", 1)[0]
+    if path == METRICS_PATH:
+        return 200, METRICS_CONTENT_TYPE, stats.prometheus()
+    if path != COMPANY_QUERY_BUILDER_PATH:
+        return _error(404, "Not found: {}".format(path))
+    if method not in ("GET", "HEAD", "POST"):
+        return _error(405, "Method not allowed: {}".format(method))
+
+    try:
+        return (200, JSON_CONTENT_TYPE,
+                coalescer.run((url, body, content_type), _build, url, body,
+                              content_type))
+    except exceptions.ClientError as e:
+        return _error(400, e.msg)
+    except exceptions.ESQueryError as e:
+        log.exception("Failed to build query for %s", url)
+        return _error(500, e.msg, e.details)
+    except Exception:
+        log.exception("Unexpected error for %s", url)
+        return _error(500, "Internal server error")
+
+
+def application(environ, start_response):
+    """WSGI entry point, for running under an external WSGI server."""
+    url = environ.get("PATH_INFO", "")
+    if environ.get("QUERY_STRING"):
+        url = "{}?{}".format(url, environ["QUERY_STRING"])
+
+    length = int(environ.get("CONTENT_LENGTH") or 0)
+    request_body = environ["wsgi.input"].read(length) if length else None
+    status, content_type, body = dispatch(environ["REQUEST_METHOD"], url,
+                                          request_body,
+                                          environ.get("CONTENT_TYPE"))
+    start_response("{} {}".format(status, BaseHTTPServer.BaseHTTPRequestHandler
+                                  .responses[status][0]),
+                   [("Content-Type", content_type),
+                    ("Content-Length", str(len(body)))])
+    return [body]
+
+
+class QueryBuilderRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """HTTP/1.1 handler, so clients can keep connections alive."""
+
+    protocol_version = "HTTP/1.1"
+
+    def _respond(self, include_body=True):
+        # Always consume the request body so the connection can be reused
+        length = int(self.headers.get("Content-Length") or 0)
+        request_body = self.rfile.read(length) if length else None
+
+        status, content_type, body = dispatch(
+            self.command, self.path, request_body,
+            self.headers.get("Content-Type"))
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if include_body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self._respond()
+
+    def do_HEAD(self):
+        self._respond(include_body=False)
+
+    def do_POST(self):
+        self._respond()
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.address_string(), format % args)
+
+
+class QueryBuilderHTTPServer(SocketServer.ThreadingMixIn,
+                             BaseHTTPServer.HTTPServer):
+    """Threaded server: each keep-alive connection gets its own thread."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+
+def serve(host, port, workers=None):
+    """Serve requests on host:port with a pre-forked pool of workers.
+
+    The listening socket is bound once and shared by every worker process,
+    so the kernel spreads connections across them.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    load_sector_taxonomy()
+    server = QueryBuilderHTTPServer((host, port), QueryBuilderRequestHandler)
+
+    children = []
+    for _ in range(workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def _terminate(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, _terminate)
+
+    try:
+        server.serve_forever()
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        server.server_close()
+
+
+if __name__ == "__main__":
+    args = docopt.docopt(__doc__)
+    workers = int(args['--workers']) if args['--workers'] else None
+    serve(args['--host'], int(args['--port']), workers)
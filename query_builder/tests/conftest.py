@@ -0,0 +1,21 @@
+import pytest
+
+from query_builder.config import settings
+from query_builder.tools.es_stub import start_stub
+
+
+@pytest.fixture
+def bool_dialect():
+    """Build queries in the bool dialect for the duration of a test."""
+    settings.ES_DIALECT = "bool"
+    yield
+    settings.ES_DIALECT = "legacy"
+
+
+@pytest.fixture
+def stub():
+    """A local Elasticsearch stub server."""
+    server = start_stub()
+    yield server
+    server.shutdown()
+    server.server_close()
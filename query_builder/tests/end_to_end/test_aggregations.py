@@ -0,0 +1,50 @@
+import pytest
+
+from query_builder.config import settings
+from query_builder.exceptions import ParameterValueError
+from query_builder.main import get_es_query
+from query_builder.tests.end_to_end.es_query_template import full_es_query
+
+
+def no_hits_query(sub_query=None, aggs=None):
+    query = full_es_query(sub_query)
+    del query["from"]
+    query["size"] = 0
+    if aggs is not None:
+        query["aggs"] = aggs
+    return query
+
+
+def test_count_only():
+    url = "/v1/company_query_builder?count_only=true&ecommerce=true"
+    assert get_es_query(url) == no_hits_query(
+        {'term': {'ecommerce.is_ecommerce': True}})
+
+
+def test_aggregate_all():
+    url = "/v1/company_query_builder?aggregate=true"
+    assert get_es_query(url) == no_hits_query(
+        aggs=settings.COMPANIES_AGGREGATIONS)
+
+
+def test_aggregate_selected():
+    url = "/v1/company_query_builder?aggregate=1&aggregation=sectors"
+    assert get_es_query(url) == no_hits_query(aggs={
+        "sectors": settings.COMPANIES_AGGREGATIONS["sectors"]})
+
+
+def test_aggregate_false_returns_hits():
+    url = "/v1/company_query_builder?aggregate=false"
+    assert get_es_query(url) == full_es_query(None)
+
+
+@pytest.mark.parametrize("url", [
+    "/v1/company_query_builder?aggregate=1&aggregation=foo",
+    "/v1/company_query_builder?aggregation=foo",
+    "/v1/company_query_builder?aggregation=sectors",
+    "/v1/company_query_builder?aggregate=false&aggregation=sectors",
+])
+def test_invalid_aggregation(url):
+    with pytest.raises(ParameterValueError) as e:
+        get_es_query(url)
+    assert "aggregation" in e.value.msg
@@ -0,0 +1,91 @@
+import logging
+
+from query_builder.app.elastic.piston import Piston
+from query_builder.app.handlers.batch import BatchQueryBuilder
+from query_builder.main import get_es_queries, get_es_query
+from query_builder.tests.end_to_end.es_query_template import full_es_query
+
+
+def test_batch_matches_single_queries():
+    urls = [
+        "/v1/company_query_builder?ecommerce=true",
+        "/v1/company_query_builder?cid=1",
+    ]
+    results = list(get_es_queries(urls))
+    assert [r.url for r in results] == urls
+    assert all(r.ok for r in results)
+    assert [r.query for r in results] == [get_es_query(url) for url in urls]
+
+
+def test_batch_reports_errors_per_item():
+    urls = [
+        "/v1/company_query_builder?unknown=1",
+        "/v1/company_query_builder?revenue=abc",
+        "/v1/company_query_builder",
+    ]
+    results = list(get_es_queries(urls))
+    assert results[0].query is None
+    assert "unknown" in results[0].error
+    assert results[1].query is None
+    assert "revenue" in results[1].error
+    assert results[2].ok
+    assert results[2].query == full_es_query(None)
+
+
+def test_malformed_pagination_is_reported_per_item():
+    urls = [
+        "/v1/company_query_builder?cid=1",
+        "/v1/company_query_builder?limit=abc",
+        "/v1/company_query_builder?offset=1.5",
+        "/v1/company_query_builder?cid=2",
+    ]
+    results = list(get_es_queries(urls))
+    assert [r.ok for r in results] == [True, False, False, True]
+    assert "limit" in results[1].error
+    assert "offset" in results[2].error
+
+
+def test_pistons_share_log_handlers():
+    Piston()
+    queries_log = logging.getLogger("query_builder.piston.queries")
+    handler_count = len(queries_log.handlers)
+    Piston()
+    assert len(queries_log.handlers) == handler_count == 1
+
+
+def test_unknown_key_reported_before_bad_pagination():
+    result = next(get_es_queries(["/v1/company_query_builder?foo=1&limit=x"]))
+    assert "Key Error: foo" in result.error
+
+
+def test_undecodable_bytes_are_reported_per_item():
+    urls = [
+        "/v1/company_query_builder?cid=1",
+        "/v1/company_query_builder?revenue=%FF",
+        "/v1/company_query_builder?fields=%C3%A9",
+        "/v1/company_query_builder?foo%FF=1",
+        "/v1/company_query_builder?cid=2",
+    ]
+    results = list(get_es_queries(urls))
+    assert [r.ok for r in results] == [True, False, False, False, True]
+    assert results[1].error == u"Value Error for key 'revenue': \ufffd"
+    assert u"\xe9" in results[2].error
+    assert results[3].error == u"Key Error: foo\ufffd"
+
+
+def test_unexpected_errors_are_reported_per_item(monkeypatch):
+    builder = BatchQueryBuilder()
+    build = builder.build
+
+    def failing_build(url, as_json=False):
+        if "cid=2" in url:
+            raise RuntimeError("boom")
+        return build(url, as_json)
+
+    monkeypatch.setattr(builder, "build", failing_build)
+    urls = ["/v1/company_query_builder?cid=1",
+            "/v1/company_query_builder?cid=2",
+            "/v1/company_query_builder?cid=3"]
+    results = list(builder.build_many(urls))
+    assert [r.ok for r in results] == [True, False, True]
+    assert results[1].error == "Internal error: boom"
@@ -0,0 +1,37 @@
+import json
+import StringIO
+
+import pytest
+
+from query_builder.main import get_es_query, translate_lines, translate_stream
+
+
+def test_translate_stream():
+    in_file = StringIO.StringIO(
+        "/v1/company_query_builder?cid=1\n"
+        "\n"
+        "/v1/company_query_builder?foo=1\n"
+        "/v1/company_query_builder?cash=1-2\n")
+    out_file = StringIO.StringIO()
+    translate_stream(in_file, out_file)
+
+    lines = out_file.getvalue().split("\n")
+    assert lines[-1] == ""
+    records = [json.loads(line) for line in lines[:-1]]
+    assert records[0] == get_es_query("/v1/company_query_builder?cid=1")
+    assert records[1]["url"] == "/v1/company_query_builder?foo=1"
+    assert "foo" in records[1]["error"]
+    assert records[2] == get_es_query("/v1/company_query_builder?cash=1-2")
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_undecodable_line_does_not_stop_the_batch(workers):
+    lines = ["/v1/company_query_builder?foo%FF=1\n",
+             "/v1/company_query_builder?sector=\xff\n",
+             "/v1/company_query_builder?cid=1\n"]
+    records = [json.loads(line) for line in translate_lines(lines, workers)]
+    assert records[0]["url"] == u"/v1/company_query_builder?foo%FF=1"
+    assert records[0]["error"] == u"Key Error: foo\ufffd"
+    assert records[1]["url"] == u"/v1/company_query_builder?sector=\ufffd"
+    assert "sector" in records[1]["error"]
+    assert records[2] == get_es_query("/v1/company_query_builder?cid=1")
@@ -0,0 +1,65 @@
+import pytest
+
+from query_builder.app.handlers.pagination import (decode_cursor,
+                                                   encode_cursor, next_cursor)
+from query_builder.config import settings
+from query_builder.exceptions import ParameterValueError
+from query_builder.main import get_es_query
+
+SORT = [{"_score": "desc"}, {"cid": "asc"}]
+
+
+def cursor_query(size=50, search_after=None):
+    query = {"query": {"bool": {"filter": [{"term": {"status": 1}}]}}}
+    query["size"] = size
+    query["sort"] = SORT
+    if search_after is not None:
+        query["search_after"] = search_after
+    return query
+
+
+def test_first_page(bool_dialect):
+    url = "/v1/company_query_builder?cursor=start"
+    assert get_es_query(url) == cursor_query()
+
+
+def test_next_page(bool_dialect):
+    token = encode_cursor([1.5, 1234])
+    url = "/v1/company_query_builder?cursor={}&limit=20".format(token)
+    assert get_es_query(url) == cursor_query(20, [1.5, 1234])
+
+
+def test_page_size_is_not_capped_by_results_limit(bool_dialect):
+    url = "/v1/company_query_builder?cursor=start&limit=800"
+    assert get_es_query(url)["size"] == 800
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor([0.25, 99])) == [0.25, 99]
+    response = {"hits": {"hits": [{"sort": [2.0, 1]}, {"sort": [1.0, 5]}]}}
+    assert decode_cursor(next_cursor(response, 2)) == [1.0, 5]
+    assert next_cursor(response, 3) is None
+
+
+@pytest.mark.parametrize("url", [
+    "/v1/company_query_builder?cursor=notacursor",
+    "/v1/company_query_builder?cursor={}".format(encode_cursor([1])),
+    "/v1/company_query_builder?cursor=start&offset=50",
+    "/v1/company_query_builder?cursor=start&limit=0",
+    "/v1/company_query_builder?cursor=start&limit=-5",
+])
+def test_invalid_cursor(bool_dialect, url):
+    with pytest.raises(ParameterValueError):
+        get_es_query(url)
+
+
+def test_cursor_requires_bool_dialect():
+    with pytest.raises(ParameterValueError) as e:
+        get_es_query("/v1/company_query_builder?cursor=start")
+    assert "bool dialect" in str(e.value)
+
+
+def test_cursor_sort_is_not_shared(bool_dialect):
+    query = get_es_query("/v1/company_query_builder?cursor=start")
+    query["sort"][0]["_score"] = "asc"
+    assert settings.CURSOR_SORT == SORT
@@ -0,0 +1,94 @@
+import pytest
+
+from query_builder.app.elastic.query_helpers import months_in_range
+from query_builder.config import settings
+from query_builder.main import get_es_query
+
+
+@pytest.fixture
+def denormalized():
+    settings.app_settings["trading_activity_mode"] = "denormalized"
+    yield settings.app_settings
+    settings.app_settings["trading_activity_mode"] = "has_child"
+    settings.app_settings["trading_activity_rounding"] = None
+
+
+def _trading_filter(url):
+    return get_es_query(url)["query"]["filtered"]["filter"]["and"][1]
+
+
+def test_open_ended_ranges_use_first_and_last_dates(denormalized):
+    assert _trading_filter(
+        "/v1/company_query_builder?trading_activity=20150110-") == {"or": [
+            {"range": {"last_import_date": {"gte": "2015-01-10"}}},
+            {"range": {"last_export_date": {"gte": "2015-01-10"}}},
+        ]}
+    assert _trading_filter(
+        "/v1/company_query_builder?trading_activity=-20150110") == {"or": [
+            {"range": {"first_import_date": {"lte": "2015-01-10"}}},
+            {"range": {"first_export_date": {"lte": "2015-01-10"}}},
+        ]}
+
+
+def test_whole_months_use_monthly_activity(denormalized):
+    months = ["2015-11", "2015-12", "2016-01", "2016-02"]
+    assert _trading_filter(
+        "/v1/company_query_builder?trading_activity=20151101-20160229") == {
+            "or": [
+                {"terms": {"import_months": months}},
+                {"terms": {"export_months": months}},
+            ]}
+
+
+def test_rounded_ranges_use_monthly_activity(denormalized):
+    denormalized["trading_activity_rounding"] = "quarter"
+    trading_filter = _trading_filter(
+        "/v1/company_query_builder?trading_activity=20150210-20150301")
+    assert trading_filter["or"][0] == {
+        "terms": {"import_months": ["2015-01", "2015-02", "2015-03"]}}
+
+
+def test_other_ranges_fall_back_to_has_child(denormalized):
+    url = "/v1/company_query_builder?trading_activity=20150110-20160110"
+    trading_filter = _trading_filter(url)
+    assert [f.keys() for f in trading_filter["or"]] == [["has_child"]] * 2
+    denormalized["trading_activity_mode"] = "has_child"
+    assert _trading_filter(url) == trading_filter
+
+
+def test_bool_dialect(denormalized, bool_dialect):
+    query = get_es_query(
+        "/v1/company_query_builder?trading_activity=20151101-20151130")
+    assert query["query"]["bool"]["filter"][1] == {
+        "bool": {
+            "should": [
+                {"terms": {"import_months": ["2015-11"]}},
+                {"terms": {"export_months": ["2015-11"]}},
+            ],
+            "minimum_should_match": 1,
+        }
+    }
+
+
+def test_exact_post_filter_keeps_has_child(denormalized):
+    denormalized["trading_activity_rounding"] = "month"
+    denormalized["trading_activity_exact_post_filter"] = True
+    try:
+        query = get_es_query(
+            "/v1/company_query_builder?trading_activity=20150110-20150220")
+    finally:
+        denormalized["trading_activity_exact_post_filter"] = False
+    main = query["query"]["filtered"]["filter"]["and"][1]
+    assert main["or"][0] == {
+        "terms": {"import_months": ["2015-01", "2015-02"]}}
+    assert list(query["post_filter"]["or"][0]) == ["has_child"]
+
+
+@pytest.mark.parametrize("gte, lte, expected", [
+    ("2015-12-01", "2016-01-31", ["2015-12", "2016-01"]),
+    ("2016-02-01", "2016-02-29", ["2016-02"]),
+    ("2016-02-01", "2016-02-28", None),
+    ("2016-02-02", "2016-03-31", None),
+])
+def test_months_in_range(gte, lte, expected):
+    assert months_in_range(gte, lte) == expected
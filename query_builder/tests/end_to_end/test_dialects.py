@@ -0,0 +1,74 @@
+import json
+
+from query_builder.main import get_es_query, get_es_query_json
+
+
+def _filters(url):
+    return get_es_query(url)["query"]["bool"]["filter"]
+
+
+def test_bool_query(bool_dialect):
+    query = get_es_query("/v1/company_query_builder?cid=4&limit=10")
+    assert query == {
+        "query": {
+            "bool": {
+                "filter": [
+                    {"term": {"status": 1}},
+                    {"terms": {"cid": ["4"]}},
+                ]
+            }
+        },
+        "from": 0,
+        "size": 10,
+    }
+
+
+def test_bool_financial_filters(bool_dialect):
+    filters = _filters("/v1/company_query_builder?revenue=1-5&cash=2-")
+    assert filters[1] == {
+        "nested": {
+            "path": "financial_filters",
+            "query": {
+                "bool": {
+                    "filter": [
+                        {"range": {"financial_filters.revenue":
+                                   {"gte": 1, "lte": 5}}},
+                        {"range": {"financial_filters.cash": {"gte": 2}}},
+                    ]
+                }
+            }
+        }
+    }
+
+
+def test_bool_exclude_tps(bool_dialect):
+    filters = _filters("/v1/company_query_builder?exclude_tps=true")
+    assert filters[1] == {
+        "bool": {"must_not": [{"exists": {"field": "tps"}}]}
+    }
+
+
+def test_bool_trading_activity(bool_dialect):
+    filters = _filters(
+        "/v1/company_query_builder?trading_activity=20150101-20160101")
+    dates = {"gte": "2015-01-01", "lte": "2016-01-01"}
+    assert filters[1] == {
+        "bool": {
+            "should": [
+                {"has_child": {
+                    "type": "import_events",
+                    "query": {"bool": {"filter": [
+                        {"range": {"import_date": dates}}]}}}},
+                {"has_child": {
+                    "type": "export_events",
+                    "query": {"bool": {"filter": [
+                        {"range": {"date": dates}}]}}}},
+            ],
+            "minimum_should_match": 1,
+        }
+    }
+
+
+def test_bool_json_output(bool_dialect):
+    url = "/v1/company_query_builder?trading_activity=20150101-&ecommerce=1"
+    assert json.loads(get_es_query_json(url)) == get_es_query(url)
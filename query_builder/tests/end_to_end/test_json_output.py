@@ -0,0 +1,24 @@
+import json
+
+import pytest
+
+from query_builder.main import get_es_query, get_es_query_json
+
+
+@pytest.mark.parametrize('url', [
+    '/v1/company_query_builder',
+    '/v1/company_query_builder?cid=1&cid=2',
+    '/v1/company_query_builder?revenue=1-100&cash=-5&ecommerce=true',
+    '/v1/company_query_builder?exclude_tps=1&sector_context=3&limit=20',
+    '/v1/company_query_builder?trading_activity=20150101-20160101',
+])
+def test_json_matches_dict_query(url):
+    query_json = get_es_query_json(url)
+    assert isinstance(query_json, str)
+    assert json.loads(query_json) == get_es_query(url)
+
+
+def test_json_is_compact():
+    query_json = get_es_query_json('/v1/company_query_builder?cid=1')
+    assert ' ' not in query_json
+    assert '\n' not in query_json
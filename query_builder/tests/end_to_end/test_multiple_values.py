@@ -1,5 +1,6 @@
 import pytest
 
+from query_builder.exceptions import ParameterValueError
 from query_builder.main import get_es_query
 from query_builder.tests.end_to_end.es_query_template import full_es_query
 
@@ -23,4 +24,34 @@ def test_multiple_values():
         'terms': {
             'cid': ['1', '2', '100']
         }
-    })
\ No newline at end of file
+    })
+
+def test_duplicate_values_are_removed_and_sorted():
+    url = "/v1/company_query_builder?cid=100&cid=2&cid=1&cid=2"
+    response = get_es_query(url)
+    assert response == full_es_query({
+        'terms': {
+            'cid': ['1', '2', '100']
+        }
+    })
+
+
+def test_invalid_ids():
+    url = "/v1/company_query_builder?cid=1&cid=abc"
+    with pytest.raises(ParameterValueError):
+        get_es_query(url)
+
+
+def test_stored_id_list_lookup():
+    url = "/v1/company_query_builder?cid_list=watchlist-7"
+    response = get_es_query(url)
+    assert response == full_es_query({
+        'terms': {
+            'cid': {
+                'index': 'cid_lists',
+                'type': 'cid_list',
+                'id': 'watchlist-7',
+                'path': 'cids'
+            }
+        }
+    })
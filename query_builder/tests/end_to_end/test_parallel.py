@@ -0,0 +1,24 @@
+import json
+
+from query_builder.app.parallel import translate_parallel
+from query_builder.benchmarks.corpus import generate_corpus
+from query_builder.main import get_es_queries
+
+URLS = generate_corpus(300, seed=11) + ["/v1/company_query_builder?foo=1"]
+
+
+def test_ordered_matches_sequential():
+    expected = list(get_es_queries(URLS, as_json=True))
+    results = list(translate_parallel(URLS, processes=2, chunk_size=16,
+                                      chunks_per_process=2))
+    assert [r.url for r in results] == URLS
+    assert [json.loads(r.query) if r.ok else r.error for r in results] == \
+        [json.loads(r.query) if r.ok else r.error for r in expected]
+    assert not results[-1].ok
+
+
+def test_unordered_returns_every_result():
+    results = list(translate_parallel(URLS, processes=2, chunk_size=16,
+                                      ordered=False, as_json=False))
+    assert sorted(r.url for r in results) == sorted(URLS)
+    assert isinstance([r for r in results if r.ok][0].query, dict)
@@ -0,0 +1,49 @@
+import os
+import tempfile
+
+import pytest
+
+from query_builder.config import settings
+from query_builder.exceptions import ParameterValueError
+from query_builder.main import get_es_query
+from query_builder.tests.end_to_end.es_query_template import full_es_query
+
+
+@pytest.fixture
+def taxonomy():
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, "w") as f:
+        f.write("# id,parent\n1\n10,1\n11,1\n110,11\n111,11\n2\n")
+    settings.SECTOR_TAXONOMY_PATH = path
+    yield
+    settings.SECTOR_TAXONOMY_PATH = None
+    settings.app_settings["sector_path_min_subtree"] = None
+    os.remove(path)
+
+
+def test_sectors_unchanged_without_taxonomy():
+    url = "/v1/company_query_builder?sector_context=5&sector_context=5"
+    assert get_es_query(url) == full_es_query(
+        {"terms": {"sector.id": ["5", "5"]}})
+
+
+def test_parent_selects_descendants(taxonomy):
+    url = "/v1/company_query_builder?sector_context=111&sector_context=11" \
+          "&sector_context=2"
+    assert get_es_query(url) == full_es_query(
+        {"terms": {"sector.id": ["11", "110", "111", "2"]}})
+
+
+def test_unknown_sector_is_rejected(taxonomy):
+    with pytest.raises(ParameterValueError) as e:
+        get_es_query("/v1/company_query_builder?sector_context=9")
+    assert "unknown sector" in str(e.value)
+
+
+def test_large_subtrees_match_by_path(taxonomy):
+    settings.app_settings["sector_path_min_subtree"] = 3
+    url = "/v1/company_query_builder?sector_context=11&sector_context=2"
+    assert get_es_query(url) == full_es_query({"or": [
+        {"terms": {"sector.id": ["2"]}},
+        {"terms": {"sector.path": ["1/11"]}},
+    ]})
@@ -0,0 +1,81 @@
+import httplib
+import json
+import threading
+
+import pytest
+
+from query_builder.main import get_es_query
+from query_builder.server import (QueryBuilderHTTPServer,
+                                  QueryBuilderRequestHandler, dispatch)
+
+
+@pytest.fixture(scope="module")
+def connection():
+    server = QueryBuilderHTTPServer(("127.0.0.1", 0),
+                                    QueryBuilderRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    conn = httplib.HTTPConnection(*server.server_address)
+    yield conn
+    conn.close()
+    server.shutdown()
+    server.server_close()
+
+
+def _get(conn, url):
+    conn.request("GET", url)
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_query(connection):
+    url = "/v1/company_query_builder?revenue=1-100&cid=3"
+    assert _get(connection, url) == (200, get_es_query(url))
+
+
+def test_keep_alive(connection):
+    url = "/v1/company_query_builder?ecommerce=true"
+    for _ in range(3):
+        assert _get(connection, url)[0] == 200
+
+
+@pytest.mark.parametrize("url, status", [
+    ("/v1/company_query_builder?foo=1", 400),
+    ("/v1/company_query_builder?revenue=abc", 400),
+    ("/v1/company_query_builder?foo%FF=1", 400),
+    ("/v1/company_query_builder?revenue=%FF", 400),
+    ("/v1/unknown", 404),
+])
+def test_errors(connection, url, status):
+    response_status, body = _get(connection, url)
+    assert response_status == status
+    assert "error" in body
+
+
+def test_error_quoting_undecodable_path():
+    status, _, body = dispatch("GET", "/v1/unknown\xff")
+    assert status == 404
+    assert json.loads(body) == {"error": u"Not found: /v1/unknown\ufffd"}
+
+
+def test_metrics(connection):
+    connection.request("GET", "/metrics")
+    response = connection.getresponse()
+    assert response.status == 200
+    assert response.getheader("Content-Type").startswith("text/plain")
+    assert "# TYPE query_builder_latency_seconds histogram" in response.read()
+
+
+@pytest.mark.parametrize("body, content_type", [
+    ("cid=5&cid=3&cid=5", "application/x-www-form-urlencoded"),
+    ('{"cid": [5, 3, 5]}', "application/json"),
+])
+def test_post_body_params(connection, body, content_type):
+    connection.request("POST", "/v1/company_query_builder?ecommerce=1", body,
+                       {"Content-Type": content_type})
+    response = connection.getresponse()
+    assert response.status == 200
+    expected = get_es_query(
+        "/v1/company_query_builder?ecommerce=1&cid=3&cid=5")
+    assert json.loads(response.read()) == expected
@@ -0,0 +1,38 @@
+import pytest
+
+from query_builder.exceptions import ParameterValueError
+from query_builder.main import get_es_query
+from query_builder.tests.end_to_end.es_query_template import full_es_query
+
+
+def source_query(source):
+    query = full_es_query(None)
+    query["_source"] = source
+    return query
+
+
+def test_fields():
+    url = "/v1/company_query_builder?fields=cid,name&fields=sector.id&fields=cid"
+    assert get_es_query(url) == source_query(
+        {"include": ["cid", "name", "sector.id"]})
+
+
+def test_exclude_fields():
+    url = "/v1/company_query_builder?fields=cid,address&exclude_fields=address.line2"
+    assert get_es_query(url) == source_query(
+        {"include": ["cid", "address"], "exclude": ["address.line2"]})
+
+
+def test_bool_dialect_source(bool_dialect):
+    query = get_es_query(
+        "/v1/company_query_builder?exclude_fields=financial_filters")
+    assert query["_source"] == {"excludes": ["financial_filters"]}
+
+
+@pytest.mark.parametrize("url", [
+    "/v1/company_query_builder?fields=password",
+    "/v1/company_query_builder?exclude_fields=cid,secret.field",
+])
+def test_unknown_fields(url):
+    with pytest.raises(ParameterValueError):
+        get_es_query(url)
@@ -0,0 +1,79 @@
+import os
+import tempfile
+
+from query_builder.benchmarks.bench import STAGES, compare, run
+from query_builder.benchmarks.corpus import generate_corpus
+from query_builder.main import get_es_queries
+
+
+def test_corpus_is_seeded_and_valid():
+    corpus = generate_corpus(200, seed=3)
+    assert corpus == generate_corpus(200, seed=3)
+    assert corpus != generate_corpus(200, seed=4)
+    assert all(result.ok for result in get_es_queries(corpus))
+
+
+def test_run_reports_every_stage():
+    log_fd, log_path = tempfile.mkstemp()
+    os.close(log_fd)
+    try:
+        results = run(generate_corpus(20), log_path)
+        with open(log_path) as f:
+            # once timed, once measuring allocations
+            assert len(f.readlines()) == 2 * 20
+    finally:
+        os.remove(log_path)
+
+    assert set(results) == set(STAGES + ["total"])
+    assert results["total"]["errors"] == 0
+    assert results["total"]["p99_us"] >= results["total"]["p50_us"]
+
+
+def test_compare_flags_regressions():
+    baseline = {"total": {"requests_per_sec": 1000.0, "p50_us": 10.0,
+                          "p99_us": 50.0}}
+    current = {"total": {"requests_per_sec": 800.0, "p50_us": 10.5,
+                         "p99_us": 80.0}}
+    regressions = compare(current, baseline, threshold=0.1)
+    assert [(stage, metric) for stage, metric, _, _ in regressions] == [
+        ("total", "requests_per_sec"), ("total", "p99_us")]
+
+
+def test_allocations_are_measured():
+    log_fd, log_path = tempfile.mkstemp()
+    os.close(log_fd)
+    try:
+        results = run(generate_corpus(20), log_path)
+    finally:
+        os.remove(log_path)
+
+    # Every built query is a tree of dicts and lists
+    assert results["query_builder"]["allocated_objects"] > 1
+    assert results["query_builder"]["max_rss_growth_kb"] >= 0
+
+
+def test_failing_urls_are_left_out_of_every_stage():
+    log_fd, log_path = tempfile.mkstemp()
+    os.close(log_fd)
+    try:
+        results = run(["/v1/company_query_builder?foo=1"] +
+                      generate_corpus(5), log_path)
+    finally:
+        os.remove(log_path)
+
+    assert results["total"]["errors"] == 1
+    assert results["parse_url"]["requests_per_sec"] is not None
+
+
+def test_summaries_without_results():
+    log_fd, log_path = tempfile.mkstemp()
+    os.close(log_fd)
+    try:
+        results = run(["/v1/company_query_builder?foo=1"], log_path)
+    finally:
+        os.remove(log_path)
+
+    assert results["total"] == {"requests_per_sec": None, "p50_us": None,
+                                "p99_us": None, "errors": 1}
+    assert results["query_builder"]["allocated_objects"] is None
+    assert compare(results, results, threshold=0.1) == []
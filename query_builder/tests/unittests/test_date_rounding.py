@@ -0,0 +1,54 @@
+import pytest
+
+from query_builder.app.elastic.query_helpers import round_date_range
+from query_builder.config import settings
+from query_builder.main import get_es_query
+
+
+@pytest.mark.parametrize("period, gte, lte, expected", [
+    ("month", "2015-01-17", "2016-01-03", ("2015-01-01", "2016-01-31")),
+    ("month", "2015-02-01", "2015-02-10", ("2015-02-01", "2015-02-28")),
+    ("quarter", "2015-05-17", "2015-12-03", ("2015-04-01", "2015-12-31")),
+    ("year", "2015-05-17", None, ("2015-01-01", None)),
+    ("quarter", None, "2016-02-29", (None, "2016-03-31")),
+])
+def test_round_date_range(period, gte, lte, expected):
+    assert round_date_range(gte, lte, period) == expected
+
+
+@pytest.fixture
+def monthly_rounding():
+    settings.app_settings["trading_activity_rounding"] = "month"
+    yield settings.app_settings
+    settings.app_settings["trading_activity_rounding"] = None
+    settings.app_settings["trading_activity_exact_post_filter"] = False
+
+
+def _trading_filter(query):
+    return query["query"]["filtered"]["filter"]["and"][1]
+
+
+def test_rounded_filters_share_cache_keys(monthly_rounding):
+    first = get_es_query(
+        "/v1/company_query_builder?trading_activity=20150103-20160104")
+    second = get_es_query(
+        "/v1/company_query_builder?trading_activity=20150110-20160120")
+    assert _trading_filter(first) == _trading_filter(second)
+
+    imports = _trading_filter(first)["or"][0]["has_child"]
+    # has_child is not cacheable, the child side filter is
+    assert "_cache" not in imports
+    assert imports["filter"]["and"][0]["range"] == {
+        "import_date": {"gte": "2015-01-01", "lte": "2016-01-31"},
+        "_cache": True,
+        "_cache_key": "import_events:import_date:2015-01-01:2016-01-31"}
+    assert "post_filter" not in first
+
+
+def test_exact_post_filter(monthly_rounding):
+    monthly_rounding["trading_activity_exact_post_filter"] = True
+    query = get_es_query(
+        "/v1/company_query_builder?trading_activity=20150103-20160104")
+    imports = query["post_filter"]["or"][0]["has_child"]
+    assert imports["filter"]["and"][0]["range"] == {
+        "import_date": {"gte": "2015-01-03", "lte": "2016-01-04"}}
@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+from query_builder.app.elastic.executor import ESExecutor
+from query_builder.app.elastic.piston import Piston
+from query_builder.exceptions import ESSearchError
+
+
+def test_concurrent_searches_are_batched(stub):
+    executor = ESExecutor(stub.url, "companies", batch_window=0.05,
+                          pool_size=2)
+    results = [None] * 20
+
+    def search(i):
+        results[i] = executor.search({"size": 1, "from": i})
+
+    threads = [threading.Thread(target=search, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    executor.close()
+
+    assert [r["hits"]["hits"][0]["_source"]["cid"] for r in results] == \
+        range(20)
+    assert stub.state.searches == 20
+    assert stub.state.msearch_requests < 20
+    assert executor.batches_sent == stub.state.msearch_requests
+
+
+def test_retries_server_errors(stub):
+    stub.state.fail_next = 2
+    executor = ESExecutor(stub.url, "companies", retries=2, pool_size=1)
+    response = executor.search('{"size":2}')
+    executor.close()
+    assert len(response["hits"]["hits"]) == 2
+    assert stub.state.requests == 3
+
+
+def test_gives_up_after_retries(stub):
+    stub.state.fail_next = 5
+    executor = ESExecutor(stub.url, "companies", retries=1, pool_size=1)
+    with pytest.raises(ESSearchError) as e:
+        executor.search({"size": 1})
+    executor.close()
+    assert e.value.status == 503
+
+
+def test_connection_errors(stub):
+    executor = ESExecutor("http://127.0.0.1:1", "companies", retries=0,
+                          pool_size=1)
+    with pytest.raises(ESSearchError):
+        executor.search({"size": 1})
+    executor.close()
+
+
+def test_piston_company_search_results(stub):
+    executor = ESExecutor(stub.url, "companies", batch_window=0)
+    piston = Piston(executor=executor)
+    results = piston.company_search_results({"size": 3, "from": 10})
+    executor.close()
+    assert results == [{"cid": 10}, {"cid": 11}, {"cid": 12}]
+
+
+def test_close_racing_searches_never_blocks(stub):
+    stub.state.latency = 0.01
+    executor = ESExecutor(stub.url, "companies", batch_window=0.005,
+                          pool_size=2)
+    outcomes = []
+
+    def search():
+        try:
+            outcomes.append(executor.search({"size": 1}))
+        except ESSearchError as e:
+            outcomes.append(e)
+
+    threads = [threading.Thread(target=search) for _ in range(20)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    executor.close()
+    for thread in threads:
+        thread.join(5)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert len(outcomes) == 20
+    answered = [o for o in outcomes if not isinstance(o, ESSearchError)]
+    assert len(answered) == stub.state.searches
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from query_builder.app.coalescing import Coalescer
+from query_builder.app.elastic.fingerprint import fingerprint
+from query_builder.app.elastic.piston import Piston
+
+
+def test_fingerprint_ignores_unordered_list_order():
+    first = {"query": {"and": [{"terms": {"cid": ["1", "2"]}},
+                               {"term": {"status": 1}}]}, "size": 5}
+    second = {"size": 5, "query": {"and": [{"term": {"status": 1}},
+                                           {"terms": {"cid": ["2", "1"]}}]}}
+    assert fingerprint(first) == fingerprint(second)
+    assert fingerprint(first) != fingerprint({"query": {}, "size": 5})
+
+
+def test_fingerprint_keeps_sort_order():
+    assert fingerprint({"sort": ["a", "b"]}) != \
+        fingerprint({"sort": ["b", "a"]})
+
+
+def test_unpaged_fingerprint():
+    page_one = {"query": {"match_all": {}}, "from": 0, "size": 50}
+    page_two = {"query": {"match_all": {}}, "from": 50, "size": 50}
+    assert fingerprint(page_one) != fingerprint(page_two)
+    assert fingerprint(page_one, False) == fingerprint(page_two, False)
+
+
+def test_company_search_returns_fingerprints():
+    piston = Piston()
+    query, fingerprints = piston.company_search(
+        {"cids": ["1", "2"], "size": 50, "from": 0}, fingerprint=True)
+    assert fingerprints.full == fingerprint(query)
+    assert fingerprints.unpaged == fingerprint(query, False)
+    _, other = piston.company_search(
+        {"cids": ["2", "1"], "size": 50, "from": 50}, fingerprint=True)
+    assert other.full != fingerprints.full
+    assert other.unpaged == fingerprints.unpaged
+
+
+def test_coalescer_shares_in_flight_result():
+    coalescer = Coalescer()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def build():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "query"
+
+    results = []
+    leader = threading.Thread(
+        target=lambda: results.append(coalescer.run("key", build)))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(
+        target=lambda: results.append(coalescer.run("key", build)))
+        for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    deadline = time.time() + 5
+    while coalescer.coalesced < 3 and time.time() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert coalescer.coalesced == 3
+
+    assert results == ["query"] * 4
+    assert len(calls) == 1
+    assert coalescer.run("key", lambda: "again") == "again"
+
+
+def test_coalescer_propagates_errors():
+    coalescer = Coalescer()
+    with pytest.raises(ValueError):
+        coalescer.run("key", int, "x")
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from query_builder import exceptions
+from query_builder.app.instrumentation import instrumented, stats
+from query_builder.main import get_es_queries
+
+
+@pytest.fixture
+def enabled_stats():
+    stats.reset()
+    stats.enabled = True
+    yield stats
+    stats.enabled = False
+    stats.reset()
+
+
+def test_disabled_records_nothing():
+    stats.reset()
+    list(get_es_queries(["/v1/company_query_builder?cash=1-2"]))
+    assert stats.snapshot() == {"latency_seconds": {}, "errors": {},
+                                "filter_usage": {}}
+
+
+def test_records_latencies_usage_and_errors(enabled_stats):
+    list(get_es_queries([
+        "/v1/company_query_builder?cash=1-2&cid=1",
+        "/v1/company_query_builder?cash=1-3",
+        "/v1/company_query_builder?foo=1",
+    ]))
+    snapshot = enabled_stats.snapshot()
+
+    assert snapshot["latency_seconds"]["handler.get"]["count"] == 3
+    assert snapshot["latency_seconds"]["piston.company_search"]["count"] == 2
+    assert snapshot["latency_seconds"]["filters.cids_filters"]["count"] == 2
+    assert snapshot["filter_usage"] == {"cash": 2, "cids": 1}
+    assert snapshot["errors"] == {
+        "handler.get:ParameterKeyError": 1,
+        "handler.parse_parameters:ParameterKeyError": 1,
+    }
+
+
+def test_prometheus_text(enabled_stats):
+    @instrumented("test.stage")
+    def fail():
+        raise exceptions.ParameterKeyError("x")
+
+    with pytest.raises(exceptions.ParameterKeyError):
+        fail()
+    text = enabled_stats.prometheus()
+    pid = 'pid="{}"'.format(os.getpid())
+
+    assert 'query_builder_latency_seconds_bucket{' + pid + \
+        ',stage="test.stage",le="+Inf"} 1' in text
+    assert 'query_builder_latency_seconds_count{' + pid + \
+        ',stage="test.stage"} 1' in text
+    assert 'query_builder_errors_total{' + pid + ',stage="test.stage",' \
+        'exception="ParameterKeyError"} 1' in text
@@ -0,0 +1,80 @@
+from query_builder.app.elastic import query_helpers
+from query_builder.app.elastic.optimizer import optimize_filters
+from query_builder.app.values import Range
+from query_builder.main import get_es_query
+
+
+def test_merges_nested_filters_on_same_path():
+    filters = optimize_filters([
+        query_helpers.financial_filters_range("revenue", Range(1, None)),
+        query_helpers.financial_filters_range("cash", Range(None, 5)),
+    ])
+    assert filters == [{
+        "nested": {
+            "path": "financial_filters",
+            "filter": {
+                "bool": {
+                    "must": [
+                        {"range": {"financial_filters.revenue": {"gte": 1}}},
+                        {"range": {"financial_filters.cash": {"lte": 5}}},
+                    ]
+                }
+            }
+        }
+    }]
+
+
+def test_drops_tautologies_and_duplicates():
+    filters = optimize_filters([
+        {"match_all": {}},
+        {"range": {"revenue": {}}},
+        {"term": {"status": 1}},
+        {"term": {"status": 1}},
+    ])
+    assert filters == [{"term": {"status": 1}}]
+
+
+def test_intersects_terms_on_same_field():
+    filters = optimize_filters([
+        {"terms": {"cid": ["1", "2", "3"]}},
+        {"terms": {"cid": ["3", "2", "9"]}},
+    ])
+    assert filters == [{"terms": {"cid": ["2", "3"]}}]
+
+
+def test_terms_on_multi_valued_field_are_kept():
+    filters = optimize_filters([
+        {"terms": {"sector.id": ["1"]}},
+        {"terms": {"sector.id": ["2"]}},
+        {"terms": {"sector.id": ["1"]}},
+    ])
+    assert filters == [{"terms": {"sector.id": ["1"]}},
+                       {"terms": {"sector.id": ["2"]}}]
+
+
+def test_orders_cheap_first():
+    child = query_helpers.build_child_doc_filter("import_events", "date",
+                                                 None, None)
+    nested = query_helpers.financial_filters_range("cash", Range(None, 5))
+    filters = optimize_filters([
+        {"or": [child]},
+        nested,
+        {"terms": {"sector.id": ["1"]}},
+        {"term": {"status": 1}},
+    ])
+    assert filters == [{"term": {"status": 1}},
+                       {"terms": {"sector.id": ["1"]}},
+                       nested,
+                       {"or": [child]}]
+
+
+def test_custom_cost_table():
+    filters = [{"terms": {"a": [1]}}, {"term": {"b": 1}}]
+    costs = {"term": 2, "terms": 1, "default": 3}
+    assert optimize_filters(filters, costs) == filters
+
+
+def test_query_has_single_financial_filters_clause():
+    query = get_es_query("/v1/company_query_builder?revenue=1-5&cash=2-9")
+    filters = query["query"]["filtered"]["filter"]["and"]
+    assert [list(f)[0] for f in filters] == ["term", "nested"]
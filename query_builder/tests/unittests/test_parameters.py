@@ -0,0 +1,77 @@
+import pytest
+
+from query_builder import exceptions
+from query_builder.app.handlers.parameters import (ParameterSchema,
+                                                   parse_id_list)
+from query_builder.app.values import DateRange, Range
+
+
+SCHEMA = ParameterSchema([
+    ("revenue", "range", None),
+    ("cid", "multi_value", "cids"),
+    ("ecommerce", "flag", None),
+    ("aggregate", "boolean", None),
+    ("trading_activity", "date_range", None),
+    ("limit", "pagination", None),
+])
+
+
+def test_parse_converts_each_type():
+    parsed = SCHEMA.parse({
+        "revenue": ["-5-10"],
+        "cid": ["1", "2"],
+        "ecommerce": ["true"],
+        "trading_activity": ["20150101-"],
+        "limit": ["10"],
+    })
+    assert parsed == {
+        "revenue": Range(-5, 10),
+        "cids": ["1", "2"],
+        "ecommerce": True,
+        "aggregate": None,
+        "trading_activity": DateRange("2015-01-01", None),
+    }
+
+
+def test_false_flag_is_omitted():
+    assert SCHEMA.parse({"ecommerce": ["0"], "aggregate": ["false"]}) == {
+        "aggregate": False}
+
+
+def test_unknown_parameters():
+    with pytest.raises(exceptions.ParameterKeyError) as e:
+        SCHEMA.parse({"foo": ["1"], "revenue": ["1-2"]})
+    assert "foo" in e.value.msg
+
+
+def test_unknown_key_reported_before_bad_values():
+    for name in ["a", "foo", "zzz"]:
+        with pytest.raises(exceptions.ParameterKeyError):
+            SCHEMA.parse({name: ["1"], "revenue": ["abc"], "limit": ["x"]})
+
+
+@pytest.mark.parametrize("params", [
+    {"revenue": ["10-1"]},
+    {"revenue": ["abc"]},
+    {"ecommerce": ["yes"]},
+    {"trading_activity": ["20151301-"]},
+    {"trading_activity": ["2015"]},
+])
+def test_invalid_values(params):
+    with pytest.raises(exceptions.ParameterValueError):
+        SCHEMA.parse(params)
+
+
+@pytest.mark.parametrize("values", [
+    ["1", "x"],
+    [u"\u00b2"],
+    [u"1", u"\u0663"],
+])
+def test_invalid_ids(values):
+    with pytest.raises(exceptions.ParameterValueError):
+        parse_id_list("cid", values)
+
+
+def test_unknown_type():
+    with pytest.raises(ValueError):
+        ParameterSchema([("foo", "bar", None)])
@@ -0,0 +1,69 @@
+from query_builder.app.elastic.piston import (Piston, _get_query_cache,
+                                              clear_query_cache)
+from query_builder.app.elastic.query_cache import QueryCache, canonical_key
+from query_builder.config import settings
+
+
+def test_canonical_key_ignores_multi_value_order():
+    assert canonical_key({"cids": ["1", "2"], "size": 50}) == \
+        canonical_key({"size": 50, "cids": ["2", "1"]})
+    assert canonical_key({"cids": ["1"]}) != canonical_key({"cids": ["2"]})
+    assert canonical_key({"revenue": {"gte": 1, "lte": 2}}) != \
+        canonical_key({"revenue": {"gte": 1, "lte": 3}})
+
+
+def test_lru_eviction_and_stats():
+    cache = QueryCache(max_size=2)
+    cache.put("a", {"a": 1})
+    cache.put("b", {"b": 1})
+    assert cache.get("a") == {"a": 1}
+    cache.put("c", {"c": 1})
+
+    assert cache.get("b") is None
+    assert cache.get("c") == {"c": 1}
+    assert cache.stats == {"size": 2, "max_size": 2, "hits": 2,
+                           "misses": 1, "evictions": 1}
+
+
+def test_cached_queries_are_copies():
+    cache = QueryCache(max_size=2)
+    query = {"query": {"and": [1]}}
+    cache.put("a", query)
+    query["query"]["and"].append(2)
+    cache.get("a")["query"]["and"].append(3)
+    assert cache.get("a") == {"query": {"and": [1]}}
+
+
+def test_piston_serves_from_cache():
+    cache = QueryCache(max_size=10)
+    piston = Piston(query_cache=cache)
+    first = piston.company_search({"cids": ["1", "2"], "size": 50, "from": 0})
+    second = piston.company_search({"cids": ["2", "1"], "size": 50, "from": 0})
+    assert first == second
+    assert first is not second
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 1
+
+
+def test_canonical_key_keeps_ordered_values():
+    assert canonical_key({"search_after": [1, 2]}) != \
+        canonical_key({"search_after": [2, 1]})
+
+
+def test_cache_key_follows_scalar_settings():
+    piston = Piston(query_cache=QueryCache(max_size=10))
+    params = {"sectors": ["1"], "size": 50, "from": 0}
+    first = piston.company_search(params)
+    settings.SECTOR_ES_FIELD = "sector.code"
+    try:
+        second = piston.company_search(params)
+    finally:
+        settings.SECTOR_ES_FIELD = "sector.id"
+    assert first != second
+
+
+def test_clear_query_cache():
+    cache = _get_query_cache()
+    cache.put("a", {"a": 1})
+    clear_query_cache()
+    assert cache.get("a") is None
@@ -0,0 +1,105 @@
+import json
+import logging
+import StringIO
+import threading
+
+from query_builder.app.elastic.piston import Piston
+from query_builder.app.elastic.query_log import (AsyncQueryLogWriter,
+                                                 OVERLOAD_DROP)
+
+
+def _logger(name):
+    stream = StringIO.StringIO()
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.handlers = [logging.StreamHandler(stream)]
+    return logger, stream
+
+
+def test_records_written_in_background():
+    logger, stream = _logger("test_query_log.written")
+    writer = AsyncQueryLogWriter(logger, flush_interval=0.01)
+    writer.write("company", {"size": 1})
+    writer.write("company", {"size": 2})
+    writer.close()
+
+    lines = stream.getvalue().splitlines()
+    assert lines == ['doc_type: company, query: {"size": 1}',
+                     'doc_type: company, query: {"size": 2}']
+    assert writer.stats["written"] == 2
+    assert writer.stats["dropped"] == 0
+
+
+def test_sampling():
+    logger, stream = _logger("test_query_log.sampled")
+    writer = AsyncQueryLogWriter(logger, sample_rate=0.0)
+    for i in range(10):
+        writer.write("company", {"size": i})
+    writer.close()
+
+    assert stream.getvalue() == ""
+    assert writer.stats["sampled_out"] == 10
+
+
+def test_drop_on_overload():
+    logger, stream = _logger("test_query_log.dropped")
+    writer = AsyncQueryLogWriter(logger, max_queue_size=1,
+                                 overload_policy=OVERLOAD_DROP)
+    logger.handlers[0].acquire()
+    try:
+        for i in range(50):
+            writer.write("company", {"size": i})
+    finally:
+        logger.handlers[0].release()
+    writer.close()
+
+    stats = writer.stats
+    assert stats["dropped"] > 0
+    assert stats["written"] + stats["dropped"] == 50
+
+
+def test_write_racing_close_is_not_queued_behind_the_sentinel():
+    logger, stream = _logger("test_query_log.close_race")
+    writer = AsyncQueryLogWriter(logger, flush_interval=0.01)
+    put_nowait = writer._queue.put_nowait
+    closer = threading.Thread(target=writer.close)
+
+    def close_while_enqueueing(item):
+        # close starts after the write saw the writer open
+        closer.start()
+        closer.join(0.1)
+        put_nowait(item)
+
+    writer._queue.put_nowait = close_while_enqueueing
+    writer.write("company", {"size": 1})
+    closer.join(5)
+    assert not closer.is_alive()
+
+    stats = writer.stats
+    assert stats["pending"] == 0
+    assert stats["written"] == stats["enqueued"] == 1
+    assert stream.getvalue() == 'doc_type: company, query: {"size": 1}\n'
+
+
+def test_piston_uses_log_writer():
+    logger, stream = _logger("test_query_log.piston")
+    writer = AsyncQueryLogWriter(logger, flush_interval=0.01)
+    query = Piston(log_writer=writer).company_search({"size": 5, "from": 0})
+    writer.close()
+
+    logged = stream.getvalue().split("query: ", 1)[1]
+    assert json.loads(logged) == query
+
+
+def test_piston_logs_query_as_returned():
+    logger, stream = _logger("test_query_log.piston_copy")
+    # The batch is only serialised once close ends it
+    writer = AsyncQueryLogWriter(logger, flush_interval=60)
+    query = Piston(log_writer=writer).company_search({"size": 5})
+    expected = json.loads(json.dumps(query))
+    query["size"] = 999
+    query.clear()
+    writer.close()
+
+    logged = stream.getvalue().split("query: ", 1)[1]
+    assert json.loads(logged) == expected
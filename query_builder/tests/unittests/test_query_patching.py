@@ -0,0 +1,68 @@
+import pytest
+
+from query_builder.app.elastic.companies_search import (
+    build_query_handle, patch_query, query_builder)
+from query_builder.app.elastic.piston import Piston
+from query_builder.app.values import IdSet, Range
+from query_builder.config import settings
+
+
+BASE = {
+    "cids": IdSet(str(cid) for cid in range(1000)),
+    "revenue": Range(1, 10),
+    "size": 50,
+    "from": 0,
+}
+
+
+@pytest.fixture(params=["legacy", "bool"])
+def dialect(request):
+    settings.ES_DIALECT = request.param
+    yield request.param
+    settings.ES_DIALECT = "legacy"
+
+
+@pytest.mark.parametrize("delta", [
+    {"ecommerce": True},
+    {"sectors": ["1", "2"], "cash": Range(None, 5)},
+    {"revenue": Range(5, None)},
+    {"revenue": None},
+    {"trading_activity": None, "from": 50},
+    {"aggregate": True},
+    {"cids": IdSet(["3"]), "cid_list": "abc"},
+])
+def test_patched_query_equals_rebuilt_query(dialect, delta):
+    patched = patch_query(build_query_handle(BASE), delta)
+
+    params = dict(BASE, **delta)
+    for key, value in delta.items():
+        if value is None:
+            del params[key]
+    assert patched.query == query_builder(params)
+    assert patched.params == params
+
+
+def test_unchanged_filters_are_shared():
+    handle = build_query_handle(BASE)
+    patched = patch_query(handle, {"ecommerce": True})
+
+    old_filters = handle.query["query"]["filtered"]["filter"]["and"]
+    new_filters = patched.query["query"]["filtered"]["filter"]["and"]
+    cids_filter = [filt for filt in old_filters if "terms" in filt][0]
+    assert any(filt is cids_filter for filt in new_filters)
+    assert patched.extras is handle.extras
+    assert "ecommerce" not in handle.params
+
+
+def test_empty_delta_returns_same_handle():
+    handle = build_query_handle(BASE)
+    assert patch_query(handle, {"revenue": Range(1, 10)}) is handle
+    assert patch_query(handle, {"cash": None}) is handle
+
+
+def test_piston_patch():
+    piston = Piston()
+    handle = piston.company_search_handle({"cids": IdSet(["1"])})
+    patched = piston.company_search_patch(handle, {"exclude_tps": True})
+    assert patched.query == piston.company_search(
+        {"cids": IdSet(["1"]), "exclude_tps": True})
@@ -0,0 +1,37 @@
+from query_builder.tools.replay import Replayer, read_queries, summarise
+
+
+def test_read_queries_from_log_and_ndjson():
+    lines = [
+        '2016-01-01 10:00:00,000 - v1 - DEBUG - doc_type: company, '
+        'query: {"size": 1}',
+        "",
+        '{"from":2}',
+        '{"url":"/v1/company_query_builder?foo=1","error":"bad"}',
+    ]
+    assert list(read_queries(lines)) == ['{"size": 1}', '{"from":2}']
+
+
+def test_replay_against_stub(stub):
+    replayer = Replayer(stub.url, "companies", "company", concurrency=3)
+    results = replayer.run(('{"size": %d}' % i for i in range(50)), limit=40)
+
+    assert stub.state.searches == 40
+    assert results["sent"] == 40
+    assert results["errors"] == 0
+    assert results["p50_ms"] <= results["p99_ms"] <= results["max_ms"]
+
+
+def test_failed_searches_are_counted(stub):
+    stub.state.fail_next = 2
+    results = Replayer(stub.url, "companies").run(['{}'] * 5)
+    assert (results["sent"], results["errors"]) == (5, 2)
+
+
+def test_rate_limits_throughput(stub):
+    results = Replayer(stub.url, "companies", rate=100).run(['{}'] * 10)
+    assert results["duration_sec"] >= 0.09
+
+
+def test_summarise_without_successes():
+    assert summarise([], 3, 1.0)["p50_ms"] is None
@@ -0,0 +1,71 @@
+import os
+import tempfile
+
+import pytest
+
+from query_builder.app.taxonomy import SectorTaxonomy, load_sector_taxonomy
+from query_builder.config import settings
+from query_builder.server import serve
+
+PAIRS = [
+    ("1", None), ("10", "1"), ("11", "1"), ("110", "11"), ("111", "11"),
+    ("2", ""), ("20", "2"),
+]
+
+
+def test_descendants_are_contiguous_in_preorder():
+    taxonomy = SectorTaxonomy(PAIRS)
+    assert taxonomy.order == ("1", "10", "11", "110", "111", "2", "20")
+    assert taxonomy.descendants("11") == ("11", "110", "111")
+    assert taxonomy.descendants("1") == taxonomy.order[:5]
+    assert taxonomy.subtree_size("1") == 5
+    assert taxonomy.subtree_size("20") == 1
+    assert taxonomy.path("111") == "1/11/111"
+    assert "3" not in taxonomy
+
+
+def test_subtree_roots_dedupe_covered_sectors():
+    taxonomy = SectorTaxonomy(PAIRS)
+    assert taxonomy.subtree_roots(["110", "11", "20", "11"]) == ["11", "20"]
+    assert taxonomy.subtree_roots(["111", "1", "2"]) == ["1", "2"]
+
+
+@pytest.mark.parametrize("pairs", [
+    [("1", None), ("1", None)],
+    [("1", "2")],
+    [("1", None), ("2", "3"), ("3", "2")],
+])
+def test_invalid_taxonomies(pairs):
+    with pytest.raises(ValueError):
+        SectorTaxonomy(pairs)
+
+
+@pytest.fixture
+def taxonomy_path():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    settings.SECTOR_TAXONOMY_PATH = path
+    yield path
+    settings.SECTOR_TAXONOMY_PATH = None
+    os.remove(path)
+
+
+def test_load_at_start_up_validates(taxonomy_path):
+    with open(taxonomy_path, "w") as f:
+        f.write("1\n10,1\n")
+    assert load_sector_taxonomy().order == ("1", "10")
+
+    settings.SECTOR_TAXONOMY_PATH = taxonomy_path + ".missing"
+    with pytest.raises(IOError):
+        load_sector_taxonomy()
+
+
+def test_server_fails_to_boot_with_invalid_taxonomy(taxonomy_path):
+    with open(taxonomy_path, "w") as f:
+        f.write("1\n1\n")
+    with pytest.raises(ValueError):
+        serve("127.0.0.1", 0, workers=2)
+
+
+def test_no_taxonomy_configured():
+    assert load_sector_taxonomy() is None
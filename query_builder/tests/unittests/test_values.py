@@ -0,0 +1,33 @@
+import pytest
+
+from query_builder.app.elastic.query_cache import canonical_key
+from query_builder.app.handlers.pagination import Pagination, encode_cursor
+from query_builder.app.handlers.parameters import parse_id_list
+from query_builder.app.values import IdSet, PageWindow, Range
+
+
+def test_value_objects_are_slotted():
+    for value in (Range(1, 2), IdSet(["1"]), PageWindow(50, 0, None, None)):
+        with pytest.raises(AttributeError):
+            value.extra = True
+
+
+def test_parsed_params_are_hashable_cache_keys():
+    first = {"revenue": Range(1, 2), "cids": parse_id_list("cid", ["2", "1"])}
+    second = {"cids": parse_id_list("cid", ["1", "2", "1"]),
+              "revenue": Range(1, 2)}
+    assert first["cids"] == IdSet(["1", "2"])
+    assert hash(canonical_key(first)) == hash(canonical_key(second))
+
+
+def test_page_window_is_computed_once():
+    pagination = Pagination("100", "60")
+    assert pagination.window == PageWindow(40, 50, None, None)
+    assert (pagination.page_size, pagination.page_offset) == (40, 50)
+
+
+def test_cursor_page_window(bool_dialect):
+    cursor = encode_cursor([1.5, "42"])
+    pagination = Pagination("20", None, cursor)
+    assert pagination.window == PageWindow(20, None, cursor, (1.5, "42"))
+    assert pagination.add_to_params({})["search_after"] == [1.5, "42"]
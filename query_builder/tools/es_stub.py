@@ -0,0 +1,131 @@
+"""
+
+Usage:
+    es_stub.py [--host=<host>] [--port=<port>] [--latency=<seconds>]
+
+Options:
+    --host=<host>         - Interface to listen on [default: 127.0.0.1].
+    --port=<port>         - Port to listen on [default: 9200].
+    --latency=<seconds>   - Delay added to every search [default: 0].
+
+Minimal local stand-in for Elasticsearch, for testing the query executor
+and replaying query logs without a live cluster. Answers _search and
+_msearch requests with generated company documents; the queries themselves
+are only parsed, not evaluated.
+"""
+import BaseHTTPServer
+import json
+import SocketServer
+import threading
+import time
+
+import docopt
+
+
+class StubState(object):
+    """Counters and behaviour shared by every stub request handler."""
+
+    def __init__(self, latency=0.0, fail_next=0):
+        self.latency = latency
+        self.fail_next = fail_next
+        self.requests = 0
+        self.searches = 0
+        self.msearch_requests = 0
+        self.lock = threading.Lock()
+
+
+def search_response(query):
+    """Fake response for a single search body."""
+    size = query.get("size", 10) if isinstance(query, dict) else 10
+    offset = query.get("from", 0) if isinstance(query, dict) else 0
+    hits = [{"_index": "companies", "_type": "company",
+             "_id": str(offset + i), "_score": 1.0,
+             "_source": {"cid": offset + i}}
+            for i in range(size)]
+    return {"took": 1, "timed_out": False,
+            "hits": {"total": len(hits), "max_score": 1.0, "hits": hits}}
+
+
+class StubRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body):
+        body = json.dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else ""
+        state = self.server.state
+
+        with state.lock:
+            state.requests += 1
+            fail = state.fail_next > 0
+            if fail:
+                state.fail_next -= 1
+        if fail:
+            return self._send(503, {"error": "stub failure", "status": 503})
+        if state.latency:
+            time.sleep(state.latency)
+
+        path = self.path.split("?", 1)[0]
+        try:
+            if path.endswith("/_msearch"):
+                lines = [line for line in body.split("\n") if line.strip()]
+                queries = [json.loads(line) for line in lines[1::2]]
+                with state.lock:
+                    state.msearch_requests += 1
+                    state.searches += len(queries)
+                return self._send(200, {"responses": [
+                    search_response(query) for query in queries]})
+            if path.endswith("/_search"):
+                with state.lock:
+                    state.searches += 1
+                return self._send(200, search_response(
+                    json.loads(body) if body else {}))
+        except ValueError:
+            return self._send(400, {"error": "malformed request body",
+                                    "status": 400})
+        return self._send(404, {"error": "no handler for " + path,
+                                "status": 404})
+
+    do_GET = do_POST = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubESServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, address, state=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StubRequestHandler)
+        self.state = state or StubState()
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address)
+
+
+def start_stub(host="127.0.0.1", port=0, **state_kwargs):
+    """Start a stub server on a background thread and return it."""
+    server = StubESServer((host, port), StubState(**state_kwargs))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    args = docopt.docopt(__doc__)
+    server = StubESServer((args["--host"], int(args["--port"])),
+                          StubState(latency=float(args["--latency"])))
+    server.serve_forever()
@@ -0,0 +1,218 @@
+"""
+
+Usage:
+    replay.py [--target=<url>] [--rate=<qps>] [--concurrency=<n>]
+              [--limit=<n>] [--timeout=<seconds>] [--output=<file>] [<log>]
+
+Options:
+    <log>                 - Query log, or NDJSON file of queries, to replay
+                            [default: logs/query_builder.piston.queries.log].
+    --target=<url>        - Elasticsearch to search, by default a local stub
+                            server is started and searched.
+    --rate=<qps>          - Queries started per second, 0 for as fast as
+                            the workers allow [default: 0].
+    --concurrency=<n>     - Number of searches in flight at once [default: 4].
+    --limit=<n>           - Stop after replaying n queries.
+    --timeout=<seconds>   - Socket timeout of each search [default: 10].
+    --output=<file>       - Write the results as JSON to this file.
+
+Re-issues the queries written by Piston to the queries log, or output by
+main.py --batch, as _search requests, reporting throughput and latency
+percentiles.
+
+With a rate set, each query's latency is measured from the time it was
+scheduled to start, so time spent queued behind slow searches is counted.
+"""
+import json
+import os
+import sys
+import threading
+import timeit
+import urlparse
+import Queue
+
+import docopt
+
+from query_builder.app.elastic.executor import RETRYABLE_ERRORS, ConnectionPool
+from query_builder.config import settings
+from query_builder.tools.es_stub import start_stub
+
+clock = timeit.default_timer
+
+# Separates the query from the prefix of a queries log line
+QUERY_LOG_MARKER = "query: "
+
+DEFAULT_LOG = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "logs", "query_builder.piston.queries.log")
+
+
+def read_queries(lines):
+    """Yield the JSON query of each line of a query log or NDJSON file.
+
+    Blank lines, and the error records of main.py --batch output, are
+    skipped.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith("{"):
+            line = line.split(QUERY_LOG_MARKER, 1)[-1]
+        if line.startswith('{"url":') and '"error":' in line:
+            continue
+        yield line
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def summarise(latencies, errors, duration):
+    """Throughput and latency percentiles, in milliseconds, of a replay."""
+    latencies = sorted(latencies)
+    sent = len(latencies) + errors
+    results = {
+        "sent": sent,
+        "errors": errors,
+        "duration_sec": duration,
+        "queries_per_sec": sent / duration if duration else None,
+    }
+    for name, fraction in (("p50_ms", 0.5), ("p90_ms", 0.9),
+                           ("p99_ms", 0.99), ("max_ms", 1.0)):
+        results[name] = _percentile(latencies, fraction) * 1e3 \
+            if latencies else None
+    return results
+
+
+class Replayer(object):
+    """Sends queries to an Elasticsearch _search endpoint.
+
+    Args:
+        url: base URL of the cluster e.g. http://localhost:9200
+        index: index searched
+        doc_type: mapping type searched, None to search every type
+        concurrency: number of searches in flight at once
+        rate: queries started per second, 0 for no limit
+        timeout: socket timeout in seconds
+    """
+
+    def __init__(self, url, index, doc_type=None, concurrency=4, rate=0,
+                 timeout=10.0):
+        parsed = urlparse.urlparse(url)
+        self.pool = ConnectionPool(parsed.hostname, parsed.port or 9200,
+                                   size=concurrency, timeout=timeout)
+        path = [parsed.path.rstrip("/"), index]
+        if doc_type:
+            path.append(doc_type)
+        self.path = "/".join(path + ["_search"])
+        self.concurrency = concurrency
+        self.rate = rate
+
+        self.latencies = []
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def _search(self, body):
+        """Run one search, returning True if it succeeded."""
+        try:
+            status, _ = self.pool.request(
+                "POST", self.path, body,
+                {"Content-Type": "application/json"})
+        except RETRYABLE_ERRORS:
+            return False
+        return status < 400
+
+    def _work(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            scheduled, body = item
+            ok = self._search(body)
+            latency = clock() - scheduled
+            with self._lock:
+                if ok:
+                    self.latencies.append(latency)
+                else:
+                    self.errors += 1
+
+    def run(self, queries, limit=None):
+        """Replay queries, returning the summary of the run.
+
+        queries is any iterable of JSON query bodies; it is consumed lazily,
+        so logs larger than memory can be replayed.
+        """
+        queue = Queue.Queue(maxsize=self.concurrency * 2)
+        workers = [threading.Thread(target=self._work, args=(queue,))
+                   for _ in range(self.concurrency)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        started = clock()
+        for count, body in enumerate(queries):
+            if limit is not None and count >= limit:
+                break
+            scheduled = clock()
+            if self.rate:
+                scheduled = started + count / float(self.rate)
+                delay = scheduled - clock()
+                if delay > 0:
+                    threading.Event().wait(delay)
+            queue.put((scheduled, body))
+
+        for _ in workers:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+        duration = clock() - started
+        self.pool.close()
+
+        return summarise(self.latencies, self.errors, duration)
+
+
+def _format_results(results):
+    lines = ["{:<16}{}".format("target", results["target"])]
+    for name in ("sent", "errors"):
+        lines.append("{:<16}{}".format(name, results[name]))
+    for name in ("duration_sec", "queries_per_sec", "p50_ms", "p90_ms",
+                 "p99_ms", "max_ms"):
+        value = results[name]
+        lines.append("{:<16}{}".format(
+            name, "n/a" if value is None else "{:.2f}".format(value)))
+    return "\n".join(lines)
+
+
+def main(args):
+    stub = None
+    target = args["--target"]
+    if not target:
+        stub = start_stub()
+        target = stub.url
+
+    replayer = Replayer(target, settings.ES_COMPANIES_INDEX,
+                        doc_type=settings.ES_COMPANIES_DOC_TYPE,
+                        concurrency=int(args["--concurrency"]),
+                        rate=float(args["--rate"]),
+                        timeout=float(args["--timeout"]))
+    limit = int(args["--limit"]) if args["--limit"] else None
+    try:
+        with open(args["<log>"] or DEFAULT_LOG) as log:
+            results = replayer.run(read_queries(log), limit=limit)
+    finally:
+        if stub is not None:
+            stub.shutdown()
+            stub.server_close()
+    results["target"] = "stub" if stub is not None else target
+
+    print _format_results(results)
+    if args["--output"]:
+        with open(args["--output"], "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(docopt.docopt(__doc__)))